@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""
+Microbenchmark of fom.api component lookups, without any requests.
+
+Times the lookups a tight loop over objects makes before each request:
+container indexing, the component's path, and fom.mapping's ``api``
+property. "new" builds a fresh component every time, as plain construction
+does; "cached" reuses a held object component; "distinct uids" indexes a
+new object each time without holding on to it, as a loop over query
+results does.
+
+Usage: python benchmarks/bench_api.py [--number N]
+"""
+
+import optparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+SETUP = '''
+from fom.api import ObjectTagApi, NamespaceApi
+from fom.mapping import Object, Namespace
+from fom.session import Fluid
+fluid = Fluid('http://localhost')
+db = fluid.db
+uid = u'8a7b6a21-8e4e-4c9a-9b0e-1c54d2bd1b87'
+tag = u'test/books/title'
+objects = fluid.objects
+obj = Object(uid, fluid)
+objapi = objects[uid]
+namespace = Namespace(u'test/books', fluid)
+import itertools, uuid
+uids = itertools.cycle([unicode(uuid.uuid4()) for i in xrange(10000)]).next
+'''
+
+CASES = [
+    ('object tag, new', 'ObjectTagApi(uid, tag, db)._make_path(None)'),
+    ('object tag, cached', 'objapi[tag]._make_path(None)'),
+    ('objects[uid][tag]', 'objects[uid][tag]._make_path(None)'),
+    ('objects[uid][tag], distinct uids',
+     'objects[uids()][tag]._make_path(None)'),
+    ('Object.api[tag]', 'obj.api[tag]._make_path(None)'),
+    ('namespace, new',
+     'NamespaceApi(u"test/books", db)._make_path(None)'),
+    ('Namespace.api', 'namespace.api._make_path(None)'),
+]
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--number', type='int', default=200000,
+                      help='lookups per case')
+    options, args = parser.parse_args()
+
+    print '%-34s %12s %12s' % ('case', 'ns/lookup', 'lookups/s')
+    for name, statement in CASES:
+        best = min(timeit.repeat(statement, SETUP, repeat=3,
+                                 number=options.number))
+        print '%-34s %12.1f %12.0f' % (
+            name, best / options.number * 1e9, options.number / best)
+
+
+if __name__ == '__main__':
+    main()
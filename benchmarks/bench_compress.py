@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+What compression saves on a slow link.
+
+Fetches tag listings, query results and large set-of-strings values, and
+writes the values back, from the stand-in server limited to --bandwidth
+bytes per second, first uncompressed and then with gzip negotiated both
+ways. Reports the time taken and the bytes counted by
+``RestClient.stats``.
+
+Usage: python benchmarks/bench_compress.py [--objects N] [--size N]
+       [--bandwidth BYTES] [--latency MS]
+"""
+
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fom.mapping import Namespace, Object
+from fom.session import Fluid
+
+from fluiddb_server import FluidDBServer
+
+TAG = u'test/compress/payload'
+
+
+def populate(fluid, objects, size):
+    Namespace(u'test', fluid).create_namespace(u'compress', u'benchmark')
+    Namespace(u'test/compress', fluid).create_tag(u'payload', u'payload',
+                                                  False)
+    value = [u'item %d of the payload' % i for i in xrange(size)]
+    uids = []
+    for i in xrange(objects):
+        obj = Object(fluid=fluid)
+        obj.create()
+        obj.set(TAG, value)
+        uids.append(obj.uid)
+    return uids, value
+
+
+def run(fluid, uids, value):
+    start = time.time()
+    fluid.objects.get(u'has %s' % TAG)
+    for uid in uids:
+        obj = Object(uid, fluid)
+        obj.tag_paths
+        obj.get(TAG)
+        obj.set(TAG, value)
+    return time.time() - start
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--objects', type='int', default=20)
+    parser.add_option('--size', type='int', default=2000,
+                      help='strings in each value')
+    parser.add_option('--bandwidth', type='int', default=1000000,
+                      help='bytes per second of the link')
+    parser.add_option('--latency', type='float', default=20,
+                      help='milliseconds per request')
+    options, args = parser.parse_args()
+
+    server = FluidDBServer(latency=options.latency / 1000.0, compress=True,
+                           bandwidth=options.bandwidth)
+    server.start()
+    fluid = Fluid(server.url)
+    fluid.db.client.login('test', 'test')
+    uids, value = populate(fluid, options.objects, options.size)
+
+    print '%d objects of %d strings, %d bytes/s, %gms per request' % (
+        options.objects, options.size, options.bandwidth, options.latency)
+    print '%-12s %9s %12s %12s %12s %12s' % (
+        'mode', 'seconds', 'sent', 'wire sent', 'received', 'wire recv')
+    for name, compress in (('plain', False), ('compressed', True)):
+        fluid = Fluid(server.url)
+        client = fluid.db.client
+        client.login('test', 'test')
+        if compress:
+            client.compress_threshold = 1024
+        else:
+            client.headers['Accept-encoding'] = 'identity'
+        elapsed = run(fluid, uids, value)
+        stats = client.stats
+        print '%-12s %9.3f %12d %12d %12d %12d' % (
+            name, elapsed, stats.sent, stats.wire_sent, stats.received,
+            stats.wire_received)
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""
+Throughput and latency benchmarks for fom against a local stand-in FluidDB.
+
+Each workload is a function taking the fluid session and an iteration number
+and performing one operation. Operations are spread over --threads threads
+and timed individually.
+
+Usage: python benchmarks/bench_fom.py [--latency MS] [--ops N] [--threads N]
+       [workload ...]
+"""
+
+import optparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fom.session import Fluid
+from fom.mapping import Namespace, Object
+
+from fluiddb_server import FluidDBServer
+
+NAMESPACE = u'test/bench'
+TAGS = [u'tag%d' % i for i in xrange(10)]
+
+
+def percentile(samples, fraction):
+    """Return the sample at the given fraction of the sorted samples.
+    """
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def populate(fluid, objects, depth=2, width=3):
+    """Create the benchmark namespace tree, its tags and some objects.
+    """
+    root = Namespace(u'test', fluid)
+    root.create_namespace(u'bench', u'benchmark namespace')
+    bench = Namespace(NAMESPACE, fluid)
+    for tag in TAGS:
+        bench.create_tag(tag, u'benchmark tag', False)
+
+    def grow(namespace, level):
+        if level == depth:
+            return
+        for i in xrange(width):
+            child = namespace.create_namespace(u'ns%d' % i, u'child')
+            child.create_tag(u'leaf', u'leaf tag', False)
+            grow(child, level + 1)
+    grow(bench, 0)
+
+    uids = []
+    for i in xrange(objects):
+        obj = Object(fluid=fluid)
+        obj.create(u'bench object %d' % i)
+        obj.set(NAMESPACE + u'/' + TAGS[0], i)
+        uids.append(obj.uid)
+    return uids
+
+
+def walk(namespace):
+    count = len(namespace.tag_paths)
+    for child in namespace.namespaces:
+        count += walk(child)
+    return count
+
+
+def make_workloads(uids):
+    def tag_write(fluid, i):
+        obj = Object(uids[i % len(uids)], fluid)
+        obj.set(NAMESPACE + u'/' + TAGS[i % len(TAGS)], i)
+
+    def tag_read(fluid, i):
+        obj = Object(uids[i % len(uids)], fluid)
+        obj.get(NAMESPACE + u'/' + TAGS[0])
+
+    def tag_has(fluid, i):
+        Object(uids[i % len(uids)], fluid).has(NAMESPACE + u'/' + TAGS[0])
+
+    def object_tag_paths(fluid, i):
+        Object(uids[i % len(uids)], fluid).tag_paths
+
+    def namespace_walk(fluid, i):
+        walk(Namespace(NAMESPACE, fluid))
+
+    def query(fluid, i):
+        fluid.objects.get(u'has %s/%s' % (NAMESPACE, TAGS[0]))
+
+    def permission_read(fluid, i):
+        fluid.permissions.namespaces[NAMESPACE].get(u'list')
+
+    return [
+        ('tag_write', tag_write),
+        ('tag_read', tag_read),
+        ('tag_has', tag_has),
+        ('object_tag_paths', object_tag_paths),
+        ('namespace_walk', namespace_walk),
+        ('query', query),
+        ('permission_read', permission_read),
+    ]
+
+
+def run(fluid, workload, ops, threads):
+    """Run ops operations over threads threads and return (elapsed, samples).
+    """
+    samples = []
+    counter = iter(xrange(ops))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                i = counter.next()
+            except StopIteration:
+                return
+            finally:
+                lock.release()
+            start = time.time()
+            workload(fluid, i)
+            samples.append(time.time() - start)
+
+    workers = [threading.Thread(target=worker) for i in xrange(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.time() - start, samples
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [workload ...]')
+    parser.add_option('--latency', type='float', default=0,
+                      help='server latency per request, in milliseconds')
+    parser.add_option('--ops', type='int', default=500,
+                      help='operations per workload')
+    parser.add_option('--objects', type='int', default=100,
+                      help='objects created before the run')
+    parser.add_option('--threads', type='int', default=1,
+                      help='client threads')
+    parser.add_option('--url', help='benchmark an already running server')
+    options, names = parser.parse_args()
+
+    server = None
+    url = options.url
+    if url is None:
+        server = FluidDBServer(latency=options.latency / 1000.0)
+        server.start()
+        url = server.url
+
+    fluid = Fluid(url)
+    fluid.db.client.login('test', 'test')
+    fluid.bind()
+    uids = populate(fluid, options.objects)
+
+    print '%-18s %10s %9s %9s %9s %9s' % (
+        'workload', 'ops/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')
+    for name, workload in make_workloads(uids):
+        if names and name not in names:
+            continue
+        elapsed, samples = run(fluid, workload, options.ops, options.threads)
+        print '%-18s %10.1f %9.2f %9.2f %9.2f %9.2f' % (
+            name, len(samples) / elapsed,
+            percentile(samples, 0.5) * 1000,
+            percentile(samples, 0.9) * 1000,
+            percentile(samples, 0.99) * 1000,
+            max(samples) * 1000)
+
+    if server is not None:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the JSON decoders available to fom.codec.
+
+Decodes representative FluidDB responses (query results, object tag listings,
+namespace listings) and Twitter timelines with every installed backend.
+
+Usage: python benchmarks/bench_json.py [repeat]
+"""
+
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fom import codec
+import twitter
+
+
+def fluiddb_query_result(count):
+    return codec.dumps({u'ids': [unicode(uuid.uuid4()) for i in xrange(count)]})
+
+
+def fluiddb_object(tags):
+    return codec.dumps({
+        u'about': u'http://example.com/some/page',
+        u'tagPaths': [u'test/tag%d' % i for i in xrange(tags)],
+    })
+
+
+def fluiddb_namespace(children):
+    return codec.dumps({
+        u'id': unicode(uuid.uuid4()),
+        u'description': u'A namespace with \xe9 in its description',
+        u'tagNames': [u'tag%d' % i for i in xrange(children)],
+        u'namespaceNames': [u'ns%d' % i for i in xrange(children)],
+    })
+
+
+def twitter_timeline(count):
+    statuses = []
+    for i in xrange(count):
+        statuses.append({
+            u'created_at': u'Sat Jan 27 04:17:38 +0000 2007',
+            u'favorited': False,
+            u'id': 4212713 + i,
+            u'text': u'FluidDB main instance is now reachable #%d' % i,
+            u'truncated': False,
+            u'source': u'<a href="http://example.com">fluiddbstatus</a>',
+            u'in_reply_to_screen_name': None,
+            u'in_reply_to_user_id': None,
+            u'in_reply_to_status_id': None,
+            u'user': {
+                u'id': 718443,
+                u'name': u'FluidDB Status',
+                u'screen_name': u'fluiddbstatus',
+                u'location': u'Internet',
+                u'description': u'Status of FluidDB instances',
+                u'profile_image_url': u'http://example.com/image.png',
+                u'url': u'http://fluidinfo.com',
+                u'protected': False,
+                u'followers_count': 123,
+            },
+        })
+    return codec.dumps(statuses)
+
+
+DOCUMENTS = [
+    ('fluiddb query (10k ids)', fluiddb_query_result(10000), None),
+    ('fluiddb object (50 tags)', fluiddb_object(50), None),
+    ('fluiddb namespace (200 children)', fluiddb_namespace(200), None),
+    ('twitter timeline (200 statuses)', twitter_timeline(200),
+        lambda data: [twitter.Status.NewFromJsonDict(x) for x in data]),
+]
+
+
+def timeit(func, arg, repeat):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        func(arg)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(repeat=20):
+    print 'selected backend: %s' % codec.backend
+    for name in codec.available_backends():
+        loads = codec.get_loads(name)
+        for title, document, build in DOCUMENTS:
+            decode = timeit(loads, document, repeat)
+            line = '%-12s %-34s %8.3f ms  %7.1f MB/s' % (
+                name, title, decode * 1000,
+                len(document) / decode / 1e6)
+            if build is not None:
+                data = loads(document)
+                line += '  (+%.3f ms building objects)' % (
+                    timeit(build, data, repeat) * 1000)
+            print line
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+Prepared requests against building each request from scratch.
+
+First times building the request parameters alone, with no network: the
+RestClient.build_request path of put_value against PreparedRequest.build.
+Then times whole tag writes and reads against the stand-in server.
+
+Usage: python benchmarks/bench_prepared.py [--number N] [--ops N] [--url URL]
+"""
+
+import optparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fom.db import PRIMITIVE_CONTENT_TYPE
+from fom.mapping import Namespace, Object
+from fom.session import Fluid
+
+from fluiddb_server import FluidDBServer
+
+TAG = u'test/prepared/rating'
+
+SETUP = '''
+from fom.db import PRIMITIVE_CONTENT_TYPE, _get_body_and_type
+from fom.session import Fluid
+fluid = Fluid('http://localhost')
+fluid.db.client.login('test', 'test')
+client = fluid.db.client
+uid = u'8a7b6a21-8e4e-4c9a-9b0e-1c54d2bd1b87'
+path = '/objects/%s/test/prepared/rating' % uid
+put = fluid.db.prepare('PUT', '/objects/%s/test/prepared/rating',
+                       PRIMITIVE_CONTENT_TYPE)
+'''
+
+BUILD_CASES = [
+    ('build_request', 'body, content_type = _get_body_and_type(5, None); '
+                      'client.build_request("PUT", path, body, None, '
+                      'content_type)'),
+    ('prepared build', 'put.build((uid,), 5)'),
+]
+
+
+def timed(ops, func):
+    start = time.time()
+    for i in xrange(ops):
+        func(i)
+    return time.time() - start
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--number', type='int', default=100000,
+                      help='builds per case')
+    parser.add_option('--ops', type='int', default=2000,
+                      help='requests per case')
+    parser.add_option('--url', help='benchmark an already running server')
+    options, args = parser.parse_args()
+
+    print '%-20s %12s %12s' % ('build', 'us/request', 'requests/s')
+    for name, statement in BUILD_CASES:
+        best = min(timeit.repeat(statement, SETUP, repeat=3,
+                                 number=options.number))
+        print '%-20s %12.2f %12.0f' % (
+            name, best / options.number * 1e6, options.number / best)
+
+    url = options.url
+    if url is None:
+        server = FluidDBServer()
+        server.start()
+        url = server.url
+    fluid = Fluid(url)
+    fluid.db.client.login('test', 'test')
+    Namespace(u'test', fluid).create_namespace(u'prepared', u'benchmark')
+    Namespace(u'test/prepared', fluid).create_tag(u'rating', u'rating',
+                                                  False)
+    obj = Object(fluid=fluid)
+    obj.create()
+    uid = obj.uid
+    objtag = fluid.objects[uid][TAG]
+    put = fluid.db.prepare('PUT', '/objects/%s/' + TAG,
+                           PRIMITIVE_CONTENT_TYPE)
+    get = fluid.db.prepare('GET', '/objects/%s/' + TAG)
+
+    cases = [
+        ('put_value', lambda i: objtag.put(i)),
+        ('prepared PUT', lambda i: put((uid,), i)),
+        ('get_value', lambda i: objtag.get()),
+        ('prepared GET', lambda i: get((uid,))),
+    ]
+    print
+    print '%-20s %12s %12s' % ('request', 'us/request', 'requests/s')
+    for name, func in cases:
+        elapsed = timed(options.ops, func)
+        print '%-20s %12.2f %12.0f' % (
+            name, elapsed / options.ops * 1e6, options.ops / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""
+Scaling of fom.shard with the number of processes.
+
+Every object gets a large set-of-strings value, so fetching it is dominated
+by decoding JSON under the GIL. The same fetches are timed with threads in
+one process, then sharded over 1, 2, 4 ... processes up to the core count.
+
+The stand-in server runs in a process of its own; being a single Python
+process it becomes the limit at some point, so use --url to measure against
+a faster server.
+
+Usage: python benchmarks/bench_shard.py [--objects N] [--size N]
+       [--processes 1,2,4] [--threads N] [--url URL]
+"""
+
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fom.bulk import WorkerPool
+from fom.mapping import Namespace, Object
+from fom.session import Fluid
+from fom.shard import ShardPool
+
+from fluiddb_server import FluidDBServer
+
+TAG = u'test/shard/payload'
+
+
+def serve(queue):
+    server = FluidDBServer()
+    queue.put(server.url)
+    server.httpd.serve_forever()
+
+
+def populate(fluid, objects, size):
+    Namespace(u'test', fluid).create_namespace(u'shard', u'shard benchmark')
+    Namespace(u'test/shard', fluid).create_tag(u'payload', u'payload', False)
+    value = [u'item %d of the payload' % i for i in xrange(size)]
+    uids = []
+    for i in xrange(objects):
+        obj = Object(fluid=fluid)
+        obj.create()
+        obj.set(TAG, value)
+        uids.append(obj.uid)
+    return uids
+
+
+def fetch(fluid, uid):
+    """Fetch the payload and build something from it, as an export would.
+    """
+    value, value_type = Object(uid, fluid).get(TAG)
+    return len(set(value))
+
+
+def run_threads(fluid, uids, threads):
+    start = time.time()
+    pool = WorkerPool(lambda uid: fetch(fluid, uid), threads)
+    for uid in uids:
+        pool.put(uid)
+    pool.join()
+    return time.time() - start
+
+
+def run_shards(url, uids, processes, threads):
+    shards = ShardPool(url, processes, pool_size=threads, threads=threads)
+    # Let the processes start before timing.
+    shards.map(fetch, uids[:processes], chunk_size=1)
+    start = time.time()
+    shards.map(fetch, uids, chunk_size=max(1, len(uids) // (processes * 8)))
+    elapsed = time.time() - start
+    shards.close()
+    return elapsed
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--objects', type='int', default=200)
+    parser.add_option('--size', type='int', default=5000,
+                      help='strings in each payload')
+    parser.add_option('--processes',
+                      help='comma separated process counts; powers of two '
+                           'up to the core count by default')
+    parser.add_option('--threads', type='int', default=4,
+                      help='threads per process')
+    parser.add_option('--url', help='benchmark an already running server')
+    options, args = parser.parse_args()
+
+    url = options.url
+    if url is None:
+        queue = multiprocessing.Queue()
+        server = multiprocessing.Process(target=serve, args=(queue,))
+        server.daemon = True
+        server.start()
+        url = queue.get()
+
+    if options.processes:
+        counts = [int(n) for n in options.processes.split(',')]
+    else:
+        counts = [1]
+        while counts[-1] * 2 <= multiprocessing.cpu_count():
+            counts.append(counts[-1] * 2)
+
+    fluid = Fluid(url)
+    fluid.db.client.login('test', 'test')
+    uids = populate(fluid, options.objects, options.size)
+
+    print '%d cores, %d objects of %d strings' % (
+        multiprocessing.cpu_count(), options.objects, options.size)
+    print '%-14s %10s %12s %9s' % ('mode', 'seconds', 'objects/s', 'speedup')
+    baseline = run_threads(fluid, uids, options.threads)
+    print '%-14s %10.3f %12.1f %9.2f' % (
+        'threads', baseline, len(uids) / baseline, 1.0)
+    for processes in counts:
+        elapsed = run_shards(url, uids, processes, options.threads)
+        print '%-14s %10.3f %12.1f %9.2f' % (
+            '%d processes' % processes, elapsed, len(uids) / elapsed,
+            baseline / elapsed)
+
+
+if __name__ == '__main__':
+    main()
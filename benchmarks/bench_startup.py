@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""
+Measure how long it takes to start fluiddbstatus.
+
+Each case is run in a fresh interpreter so nothing is already imported. The
+"deferred" cases are what fluiddbstatus pays up front; the "eager" cases are
+what it would pay if twitter and fom were imported at module load.
+
+Usage: python benchmarks/bench_startup.py [repeat]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CASES = [
+    ('interpreter only', 'pass'),
+    ('import fluiddbstatus (deferred)', 'import fluiddbstatus'),
+    ('+ fom.session (first probe)',
+        'import fluiddbstatus; import fom.session'),
+    ('+ twitter (first post, eager)',
+        'import fluiddbstatus; import fom.session; import twitter'),
+]
+
+
+def run(statement, repeat):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statement], cwd=ROOT)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def count_modules(statement):
+    output = subprocess.Popen(
+        [sys.executable, '-c', statement + '; import sys; print len(sys.modules)'],
+        cwd=ROOT, stdout=subprocess.PIPE).communicate()[0]
+    return int(output.strip())
+
+
+def main(repeat=10):
+    for title, statement in CASES:
+        print '%-34s %8.1f ms  %4d modules' % (
+            title, run(statement, repeat) * 1000, count_modules(statement))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
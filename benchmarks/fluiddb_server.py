@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+
+"""
+A local, in-process stand-in for the FluidDB REST API.
+
+It implements the parts of the API that fom.api uses (users, objects, object
+tags, namespaces, tags, permissions and policies) against in-memory state,
+with an optional artificial latency per request and bandwidth limit, so fom
+can be benchmarked without a network or a real FluidDB. With ``compress``
+set it gzips responses for clients that accept it and takes gzipped request
+bodies; otherwise it answers those with 415.
+
+>>> server = FluidDBServer(latency=0.005)
+>>> server.start()
+>>> fluid = Fluid(server.url)
+>>> server.stop()
+
+Queries only understand ``has <tag>`` and ``<tag> = <value>``; anything else
+matches every object.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import os
+import re
+import sys
+import threading
+import time
+import urlparse
+import uuid
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fom import codec
+from fom.db import PRIMITIVE_CONTENT_TYPE
+
+ABOUT_TAG = 'fluiddb/about'
+#: Smaller response bodies are not worth compressing.
+COMPRESS_MIN = 256
+
+_HAS_QUERY = re.compile(r'^\s*has\s+(\S+)\s*$')
+_EQUALS_QUERY = re.compile(r'^\s*(\S+)\s*=\s*(.+?)\s*$')
+
+
+class FluidDBState(object):
+    """The objects, namespaces, tags and permissions held by the server.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+        self.objects = {}
+        self.abouts = {}
+        self.namespaces = {}
+        self.tags = {}
+        self.permissions = {}
+        self.policies = {}
+        self.add_user(u'fluiddb')
+        self.add_user(u'test')
+
+    def add_user(self, name):
+        self.users[name] = unicode(uuid.uuid4())
+        self.namespaces[name] = {u'id': unicode(uuid.uuid4()),
+                                 u'description': u'%s namespace' % name}
+
+    def create_object(self, about=None):
+        if about is not None and about in self.abouts:
+            return self.abouts[about]
+        uid = unicode(uuid.uuid4())
+        self.objects[uid] = {}
+        if about is not None:
+            self.objects[uid][ABOUT_TAG] = (codec.dumps(about),
+                                            PRIMITIVE_CONTENT_TYPE)
+            self.abouts[about] = uid
+        return uid
+
+    def query(self, query):
+        match = _HAS_QUERY.match(query)
+        if match:
+            tag = match.group(1)
+            return [uid for uid, tags in self.objects.iteritems()
+                    if tag in tags]
+        match = _EQUALS_QUERY.match(query)
+        if match:
+            tag, value = match.groups()
+            try:
+                value = codec.dumps(codec.loads(value))
+            except ValueError:
+                value = codec.dumps(value)
+            return [uid for uid, tags in self.objects.iteritems()
+                    if tags.get(tag, (None,))[0] == value]
+        return self.objects.keys()
+
+    def children(self, path, mapping):
+        prefix = path + '/'
+        return [p[len(prefix):] for p in mapping
+                if p.startswith(prefix) and '/' not in p[len(prefix):]]
+
+
+class FluidDBHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Dispatches requests by toplevel to ``<toplevel>_<method>`` methods.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Write each response in one segment; unbuffered header lines trip
+    # Nagle's algorithm against delayed ACKs on keep-alive connections.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def handle_request(self, method):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        parsed = urlparse.urlparse(self.path)
+        self.args = dict(urlparse.parse_qsl(parsed.query))
+        parts = [urlparse.unquote(p) for p in parsed.path.split('/')[1:]]
+        length = int(self.headers.get('content-length') or 0)
+        self.body = self.rfile.read(length)
+        self.throttle(length)
+        handler = getattr(self, '%s_%s' % (parts[0].replace('-', '_'),
+                                          method), None)
+        if handler is None:
+            return self.respond(405)
+        encoding = self.headers.get('content-encoding')
+        if encoding:
+            if encoding != 'gzip' or not self.server.compress:
+                return self.respond(415)
+            self.body = zlib.decompress(self.body, 16 + zlib.MAX_WBITS)
+        self.state.lock.acquire()
+        try:
+            handler(parts[1:])
+        except KeyError:
+            self.respond(404)
+        finally:
+            self.state.lock.release()
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_HEAD(self):
+        self.handle_request('HEAD')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def respond(self, status, data=None, content_type='application/json'):
+        body = ''
+        if data is not None:
+            if content_type == 'application/json':
+                body = codec.dumps(data)
+            else:
+                body = data
+        self.send_response(status)
+        if body:
+            self.send_header('Content-Type', content_type)
+            if self.server.compress and len(body) >= COMPRESS_MIN and \
+                    'gzip' in self.headers.get('accept-encoding', ''):
+                compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                              16 + zlib.MAX_WBITS)
+                body = compressor.compress(body) + compressor.flush()
+                self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.throttle(len(body))
+            self.wfile.write(body)
+
+    def throttle(self, length):
+        """Take as long as length bytes would over the server's bandwidth.
+        """
+        if self.server.bandwidth:
+            time.sleep(float(length) / self.server.bandwidth)
+
+    def flag(self, name):
+        return self.args.get(name) == 'True'
+
+    def json_body(self):
+        return codec.loads(self.body)
+
+    # /users
+
+    def users_GET(self, parts):
+        name = parts[0]
+        self.respond(200, {u'name': name, u'id': self.state.users[name]})
+
+    # /objects
+
+    def objects_GET(self, parts):
+        if not parts:
+            return self.respond(200,
+                {u'ids': self.state.query(self.args.get('query', ''))})
+        tags = self.state.objects[parts[0]]
+        if len(parts) == 1:
+            data = {u'tagPaths': sorted(tags)}
+            if self.flag('showAbout') and ABOUT_TAG in tags:
+                data[u'about'] = codec.loads(tags[ABOUT_TAG][0])
+            return self.respond(200, data)
+        value, content_type = tags['/'.join(parts[1:])]
+        self.respond(200, value, content_type)
+
+    def objects_HEAD(self, parts):
+        self.state.objects[parts[0]]['/'.join(parts[1:])]
+        self.respond(200)
+
+    def objects_POST(self, parts):
+        about = None
+        if self.body:
+            about = self.json_body().get(u'about')
+        uid = self.state.create_object(about)
+        self.respond(201, {u'id': uid, u'URI': u'/objects/' + uid})
+
+    def objects_PUT(self, parts):
+        tags = self.state.objects[parts[0]]
+        content_type = self.headers.get('content-type',
+                                        PRIMITIVE_CONTENT_TYPE)
+        tags['/'.join(parts[1:])] = (self.body, content_type)
+        self.respond(204)
+
+    def objects_DELETE(self, parts):
+        del self.state.objects[parts[0]]['/'.join(parts[1:])]
+        self.respond(204)
+
+    # /namespaces
+
+    def namespaces_GET(self, parts):
+        path = '/'.join(parts)
+        namespace = self.state.namespaces[path]
+        data = {u'id': namespace[u'id']}
+        if self.flag('returnDescription'):
+            data[u'description'] = namespace[u'description']
+        if self.flag('returnNamespaces'):
+            data[u'namespaceNames'] = self.state.children(
+                path, self.state.namespaces)
+        if self.flag('returnTags'):
+            data[u'tagNames'] = self.state.children(path, self.state.tags)
+        self.respond(200, data)
+
+    def namespaces_POST(self, parts):
+        data = self.json_body()
+        path = '/'.join(parts + [data[u'name']])
+        uid = unicode(uuid.uuid4())
+        self.state.namespaces[path] = {u'id': uid,
+                                       u'description': data[u'description']}
+        self.respond(201, {u'id': uid, u'URI': u'/namespaces/' + path})
+
+    def namespaces_PUT(self, parts):
+        namespace = self.state.namespaces['/'.join(parts)]
+        namespace[u'description'] = self.json_body()[u'description']
+        self.respond(204)
+
+    def namespaces_DELETE(self, parts):
+        del self.state.namespaces['/'.join(parts)]
+        self.respond(204)
+
+    # /tags
+
+    def tags_GET(self, parts):
+        tag = self.state.tags['/'.join(parts)]
+        data = {u'id': tag[u'id'], u'indexed': tag[u'indexed']}
+        if self.flag('returnDescription'):
+            data[u'description'] = tag[u'description']
+        self.respond(200, data)
+
+    def tags_POST(self, parts):
+        data = self.json_body()
+        path = '/'.join(parts + [data[u'name']])
+        uid = unicode(uuid.uuid4())
+        self.state.tags[path] = {u'id': uid,
+                                 u'description': data[u'description'],
+                                 u'indexed': data[u'indexed']}
+        self.respond(201, {u'id': uid, u'URI': u'/tags/' + path})
+
+    def tags_PUT(self, parts):
+        tag = self.state.tags['/'.join(parts)]
+        tag[u'description'] = self.json_body()[u'description']
+        self.respond(204)
+
+    def tags_DELETE(self, parts):
+        del self.state.tags['/'.join(parts)]
+        self.respond(204)
+
+    # /permissions
+
+    def permissions_GET(self, parts):
+        key = (parts[0], '/'.join(parts[1:]), self.args.get('action'))
+        self.respond(200, self.state.permissions.get(key,
+            {u'policy': u'open', u'exceptions': []}))
+
+    def permissions_PUT(self, parts):
+        key = (parts[0], '/'.join(parts[1:]), self.args.get('action'))
+        self.state.permissions[key] = self.json_body()
+        self.respond(204)
+
+    # /policies
+
+    def policies_GET(self, parts):
+        self.respond(200, self.state.policies.get(tuple(parts),
+            {u'policy': u'open', u'exceptions': []}))
+
+    def policies_PUT(self, parts):
+        self.state.policies[tuple(parts)] = self.json_body()
+        self.respond(204)
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FluidDBServer(object):
+    """Runs a stand-in FluidDB in a background thread.
+
+    :param latency: Seconds to sleep before answering each request.
+    :param port: Port to listen on; 0 picks a free one.
+    :param compress: Whether to gzip responses and take gzipped bodies.
+    :param bandwidth: Bytes per second bodies are slowed down to, if any.
+    """
+
+    def __init__(self, latency=0, host='127.0.0.1', port=0, state=None,
+                 compress=False, bandwidth=None):
+        self.httpd = _ThreadingHTTPServer((host, port), FluidDBHandler)
+        self.httpd.latency = latency
+        self.httpd.compress = compress
+        self.httpd.bandwidth = bandwidth
+        self.httpd.state = state or FluidDBState()
+        self.thread = None
+
+    @property
+    def state(self):
+        return self.httpd.state
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    server = FluidDBServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    print 'Serving a stand-in FluidDB on %s' % server.url
+    server.httpd.serve_forever()
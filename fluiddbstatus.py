@@ -3,11 +3,44 @@
 import pickle
 import os
 import sys
+import bisect
 import logging
+import optparse
 import ConfigParser
-from httplib import HTTPConnection, socket
-from fom.session import Fluid
-import twitter
+import threading
+import time
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from httplib import HTTPException, socket
+
+REFERENCE_ENDPOINTS = ['www.google.com', 'www.wikipedia.org']
+# Probed when the config has no [targets] section, each over every scheme
+TARGETS = [('main', 'fluiddb.fluidinfo.com'),
+           ('sandbox', 'sandbox.fluidinfo.com')]
+SCHEMES = ['http', 'https']
+# Defaults for the [health] section used by the endpoint health probes
+HEALTH_DEFAULTS = {
+    'query': 'fluiddb/users/username = "fluiddb"',
+    'namespace': 'fluiddb',
+    'scratch_about': 'fluiddbstatus scratch object',
+}
+# Latency samples kept per test in the pickle
+STATS_SAMPLES = 100
+PRECHECK_TIMEOUT = 5
+REACHABLE_TTL = 60
+# Raw probe samples kept per test in the history file
+HISTORY_SAMPLES = 1000
+# (name, seconds per bucket, buckets kept) of the history rollups
+ROLLUPS = [('minute', 60, 24 * 60),
+           ('hour', 3600, 35 * 24),
+           ('day', 86400, 400)]
+# Upper bounds in seconds of the latency histogram buckets of the rollups,
+# 25% apart from 1 ms up to about 9 minutes
+LATENCY_BOUNDS = [0.001 * 1.25 ** i for i in range(60)]
+# Windows of the history served by the status server, and its percentiles
+STATUS_WINDOWS = [('1h', 3600), ('24h', 86400), ('30d', 30 * 86400)]
+STATUS_QUANTILES = [('p50', '0.5'), ('p90', '0.9'), ('p99', '0.99')]
 
 def get_site_status(url):
     response = get_response(url)
@@ -16,16 +49,20 @@ def get_site_status(url):
             return 'up'
     except AttributeError:
         pass
-    loggin.error('DOWN: %s status: %s', url, response.status)
+    logging.error('DOWN: %s status: %s', url, getattr(response, 'status', None))
     return 'down'
 
-def get_response(url):
-    '''Return response object from URL'''
+def get_response(url, timeout=None, sockets=None):
+    '''Return response object from URL. Its socket is appended to sockets
+    before connecting, when given.'''
+    # Importing any of fom loads all of it, so it waits for the first probe
+    from fom.resolver import HTTPConnection
     try:
-        conn = HTTPConnection(url)
+        conn = HTTPConnection(url, timeout=timeout)
+        conn.sockets = sockets
         conn.request('HEAD', '/')
         return conn.getresponse()
-    except socket.error:
+    except (socket.error, HTTPException):
         return None
     except:
         logging.error('Bad URL: %s', url)
@@ -46,24 +83,562 @@ def store_results(file_path, data):
     pickle.dump(data, output)
     output.close()
 
-def is_internet_reachable():
-    '''Checks if Google is down'''
-    return get_site_status('www.google.com') == 'up'
+def resolve_probe_hosts(urls):
+    '''Resolves every probe host at once before a probe round, so the probes
+    themselves do not pay for DNS, and logs how long each lookup took.'''
+    from fom.resolver import resolver
+    addresses = []
+    for url in urls:
+        if '//' not in url:
+            # A bare host or host:port, as reference endpoints are given
+            url = '//' + url
+        parsed = urlparse.urlparse(url)
+        if parsed.hostname:
+            default_port = {'https': 443}.get(parsed.scheme, 80)
+            addresses.append((parsed.hostname, parsed.port or default_port))
+    latencies = resolver.resolve_many(addresses)
+    for (host, port), latency in sorted(latencies.items()):
+        if latency is None:
+            logging.error('DNS: %s does not resolve', host)
+        else:
+            logging.info('DNS: %s resolved in %.1f ms', host, latency * 1000)
+    return latencies
+
+class Ring(object):
+    '''Keeps the latest size items appended, oldest first'''
+    def __init__(self, size):
+        self.size = size
+        self.items = []
+        self.next = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items[self.next:] + self.items[:self.next])
+
+    def append(self, item):
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            self.items[self.next] = item
+        self.next = (self.next + 1) % self.size
+
+    def first(self):
+        if len(self.items) < self.size:
+            return self.items[0]
+        return self.items[self.next]
+
+    def last(self):
+        return self.items[self.next - 1]
+
+    def full(self):
+        return len(self.items) == self.size
+
+def add_sample(bucket, passed, latency):
+    '''Counts a probe result in a [start, count, failures, min latency,
+    max latency, {histogram bucket: count}] rollup bucket. Only the latency
+    of passed probes is counted.'''
+    bucket[1] += 1
+    if not passed:
+        bucket[2] += 1
+    elif latency is not None:
+        if bucket[3] is None or latency < bucket[3]:
+            bucket[3] = latency
+        if bucket[4] is None or latency > bucket[4]:
+            bucket[4] = latency
+        i = bisect.bisect_left(LATENCY_BOUNDS, latency)
+        bucket[5][i] = bucket[5].get(i, 0) + 1
+
+def histogram_percentile(histogram, fraction, low, high):
+    '''Returns the latency at fraction (0 to 1) of a rollup histogram, as
+    the geometric middle of its bucket kept within low and high'''
+    rank = max(1, fraction * sum(histogram.values()))
+    seen = 0
+    for i in sorted(histogram):
+        seen += histogram[i]
+        if seen >= rank:
+            if i >= len(LATENCY_BOUNDS):
+                return high
+            if i == 0:
+                middle = LATENCY_BOUNDS[0]
+            else:
+                middle = (LATENCY_BOUNDS[i - 1] * LATENCY_BOUNDS[i]) ** 0.5
+            return max(low, min(high, middle))
+
+class History(object):
+    '''Time series of the probe results of every test. The latest raw
+    samples, and minute, hour and day rollups of the count, failures and
+    latencies, are each kept in a fixed size ring, so the history file
+    stops growing once the rings are full.'''
+    def __init__(self, path=None):
+        self.path = path
+        self.tests = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        history = cls(path)
+        if os.path.isfile(path):
+            historyfile = open(path, 'rb')
+            try:
+                data = pickle.load(historyfile)
+            finally:
+                historyfile.close()
+            # Rings are pickled as plain (size, items, next) tuples, so the
+            # file does not depend on where this module was loaded from
+            for testname, series in data.iteritems():
+                history.tests[testname] = {}
+                for name, (size, items, next) in series.iteritems():
+                    ring = history.tests[testname][name] = Ring(size)
+                    ring.items, ring.next = items, next
+        return history
+
+    def save(self):
+        '''Writes the history file, replacing it in one step'''
+        self.lock.acquire()
+        try:
+            data = pickle.dumps(dict(
+                (testname, dict((name, (ring.size, ring.items, ring.next))
+                                for name, ring in series.iteritems()))
+                for testname, series in self.tests.iteritems()),
+                pickle.HIGHEST_PROTOCOL)
+        finally:
+            self.lock.release()
+        output = open(self.path + '.tmp', 'wb')
+        try:
+            output.write(data)
+        finally:
+            output.close()
+        os.rename(self.path + '.tmp', self.path)
+
+    def add(self, testname, passed, latency, when=None):
+        if when is None:
+            when = time.time()
+        self.lock.acquire()
+        try:
+            series = self.tests.get(testname)
+            if series is None:
+                series = self.tests[testname] = {
+                    'raw': Ring(HISTORY_SAMPLES)}
+                for name, width, size in ROLLUPS:
+                    series[name] = Ring(size)
+            series['raw'].append((when, passed, latency))
+            for name, width, size in ROLLUPS:
+                ring = series[name]
+                start = when - when % width
+                if not ring or ring.last()[0] < start:
+                    ring.append([start, 0, 0, None, None, {}])
+                add_sample(ring.last(), passed, latency)
+        finally:
+            self.lock.release()
+
+    def latest(self, testname):
+        '''Returns the latest (time, passed, latency) sample of a test'''
+        self.lock.acquire()
+        try:
+            return self.tests[testname]['raw'].last()
+        finally:
+            self.lock.release()
+
+    def find(self, *words):
+        '''Returns the names of the tests containing every word, as in
+        find('sandbox', 'https')'''
+        words = [word.lower() for word in words]
+        return sorted(name for name in self.tests
+                      if all(word in name.lower() for word in words))
+
+    def summary(self, testnames, since, until=None):
+        '''Returns the count, failures, availability and latency min, max
+        and percentiles of the tests between since and until. Each test is
+        read from its raw samples when they reach back to since, otherwise
+        from its finest rollup that does; a rollup counts whole buckets.'''
+        if until is None:
+            until = time.time()
+        count = failures = 0
+        latencies = []
+        histogram = {}
+        low = high = None
+        self.lock.acquire()
+        try:
+            for testname in testnames:
+                series = self.tests.get(testname)
+                if series is None:
+                    continue
+                raw = series['raw']
+                if raw and (not raw.full() or raw.first()[0] <= since):
+                    for when, passed, latency in raw:
+                        if since <= when < until:
+                            count += 1
+                            if not passed:
+                                failures += 1
+                            elif latency is not None:
+                                latencies.append(latency)
+                    continue
+                for name, width, size in ROLLUPS:
+                    ring = series[name]
+                    if not ring.full() or ring.first()[0] <= since:
+                        break
+                for bucket in ring:
+                    if bucket[0] + width <= since or bucket[0] >= until:
+                        continue
+                    count += bucket[1]
+                    failures += bucket[2]
+                    for i, n in bucket[5].iteritems():
+                        histogram[i] = histogram.get(i, 0) + n
+                    if bucket[3] is not None:
+                        low = min(low, bucket[3]) if low is not None \
+                            else bucket[3]
+                        high = max(high, bucket[4])
+        finally:
+            self.lock.release()
+
+        summary = {'count': count, 'failures': failures,
+                   'availability': None, 'min': None, 'max': None}
+        if count:
+            summary['availability'] = float(count - failures) / count
+        if histogram:
+            for latency in latencies:
+                i = bisect.bisect_left(LATENCY_BOUNDS, latency)
+                histogram[i] = histogram.get(i, 0) + 1
+            low = min([low] + latencies)
+            high = max([high] + latencies)
+            percentile = lambda fraction: histogram_percentile(
+                histogram, fraction, low, high)
+        elif latencies:
+            latencies.sort()
+            low, high = latencies[0], latencies[-1]
+            percentile = lambda fraction: latencies[
+                min(len(latencies) - 1, int(len(latencies) * fraction))]
+        else:
+            percentile = lambda fraction: None
+        summary['min'], summary['max'] = low, high
+        for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            summary[name] = percentile(fraction)
+        return summary
+
+def prometheus_labels(labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                                 .replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in labels)
+
+def prometheus_metric(name, kind, description, samples):
+    '''Returns the lines of a metric in the Prometheus text format, for
+    samples of (labels, value); samples without a value are left out'''
+    lines = ['# HELP %s %s' % (name, description), '# TYPE %s %s' % (name, kind)]
+    for labels, value in samples:
+        if value is not None:
+            lines.append('%s{%s} %r' % (name, prometheus_labels(labels),
+                                        float(value)))
+    return lines
+
+class StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Answers with the documents last rendered by the StatusServer'''
+    # Seconds a slow client may hold its connection
+    timeout = 10
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        document = self.server.status.documents.get(self.path.split('?')[0])
+        if document is None:
+            content_type, body = 'text/plain', 'Not found\n'
+            self.send_response(404)
+        else:
+            content_type, body = document
+            self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class StatusHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class StatusServer(object):
+    '''Serves the latest result of every test, with the availability and
+    latency percentiles of the history over STATUS_WINDOWS, as JSON on
+    /status and in the Prometheus text format on /metrics. Both documents
+    are rendered from memory once per probe round by update, so a request
+    only copies one out and never waits for the probes.'''
+    def __init__(self, history=None, host='127.0.0.1', port=8080):
+        self.history = history
+        self.latest = {}
+        self.circuits = {}
+        self.httpd = StatusHTTPServer((host, port), StatusHandler)
+        self.httpd.status = self
+        self.thread = None
+        self.update({}, {})
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def update(self, results, circuits, when=None):
+        '''Takes the results of a probe round, as returned by run_fanout,
+        and renders the documents again'''
+        from fom import codec
+        if when is None:
+            when = time.time()
+        for host, hostresults in results.items():
+            for testname, ret, changedmsg, latency in hostresults:
+                self.latest[testname] = {
+                    'host': host, 'passed': bool(ret[0]), 'message': ret[1],
+                    'latency': latency, 'time': when}
+        self.circuits = circuits
+
+        testnames = set(self.latest)
+        if self.history is not None:
+            testnames.update(self.history.tests)
+        tests = {}
+        for testname in testnames:
+            test = dict(self.latest.get(testname, {}))
+            if self.history is not None and testname in self.history.tests:
+                test['windows'] = dict(
+                    (window, self.history.summary([testname], when - seconds,
+                                                  when))
+                    for window, seconds in STATUS_WINDOWS)
+            tests[testname] = test
+        status = {'time': when, 'tests': tests, 'circuits': circuits}
+        # Replaced in one step, so requests see one round or the other
+        self.documents = {
+            '/status': ('application/json', codec.dumps(status)),
+            '/metrics': ('text/plain; version=0.0.4',
+                         self.render_metrics(tests, circuits)),
+        }
+
+    def render_metrics(self, tests, circuits):
+        from fom import breaker
+        latest = [(testname, tests[testname]) for testname in sorted(tests)
+                  if 'passed' in tests[testname]]
+        windows = [((('test', testname), ('window', window)), summary)
+                   for testname in sorted(tests)
+                   for window, summary in sorted(
+                       tests[testname].get('windows', {}).items())]
+        lines = []
+        lines += prometheus_metric('fluiddbstatus_up', 'gauge',
+            'Whether the latest probe of a test passed.',
+            [((('test', name),), test['passed']) for name, test in latest])
+        lines += prometheus_metric('fluiddbstatus_latency_seconds', 'gauge',
+            'Latency of the latest probe of a test.',
+            [((('test', name),), test['latency']) for name, test in latest])
+        lines += prometheus_metric('fluiddbstatus_last_probe_timestamp_seconds',
+            'gauge', 'When the latest probe of a test ran.',
+            [((('test', name),), test['time']) for name, test in latest])
+        lines += prometheus_metric('fluiddbstatus_probes', 'gauge',
+            'Probes of a test in the window.',
+            [(labels, summary['count']) for labels, summary in windows])
+        lines += prometheus_metric('fluiddbstatus_failures', 'gauge',
+            'Failed probes of a test in the window.',
+            [(labels, summary['failures']) for labels, summary in windows])
+        lines += prometheus_metric('fluiddbstatus_availability', 'gauge',
+            'Fraction of the probes of a test in the window that passed.',
+            [(labels, summary['availability'])
+             for labels, summary in windows])
+        lines += prometheus_metric('fluiddbstatus_window_latency_seconds',
+            'gauge', 'Latency percentiles of a test in the window.',
+            [(labels + (('quantile', quantile),), summary[name])
+             for labels, summary in windows
+             for name, quantile in STATUS_QUANTILES])
+        lines += prometheus_metric('fluiddbstatus_circuit_closed', 'gauge',
+            'Whether the circuit breaker of a host is closed.',
+            [((('host', host),), circuit['state'] == breaker.CLOSED)
+             for host, circuit in sorted(circuits.items())])
+        lines += prometheus_metric('fluiddbstatus_circuit_failures', 'gauge',
+            'Consecutive failures counted by the circuit breaker of a host.',
+            [((('host', host),), circuit['failures'])
+             for host, circuit in sorted(circuits.items())])
+        return '\n'.join(lines) + '\n'
+
+class SocketTracker(object):
+    '''Collects sockets as they are created so they can all be shut down
+    at once, which also interrupts those still connecting. Sockets created
+    after that are refused before they connect.'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sockets = []
+        self.cancelled = False
+
+    def append(self, sock):
+        self.lock.acquire()
+        try:
+            if self.cancelled:
+                raise socket.error('cancelled')
+            self.sockets.append(sock)
+        finally:
+            self.lock.release()
+
+    def cancel(self):
+        self.lock.acquire()
+        try:
+            self.cancelled = True
+            for sock in self.sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+        finally:
+            self.lock.release()
+
+_last_reachable = [0, None]
+
+def is_internet_reachable(endpoints=REFERENCE_ENDPOINTS,
+                          timeout=PRECHECK_TIMEOUT, ttl=0):
+    '''Checks the reference endpoints in parallel. The first one to answer
+    decides, and the checks still pending are cancelled, even mid-connect.
+    A result is reused for ttl seconds.'''
+    checked, reachable = _last_reachable
+    if ttl and checked + ttl > time.time():
+        return reachable
+
+    done = threading.Event()
+    lock = threading.Lock()
+    sockets = SocketTracker()
+    state = {'up': False, 'pending': len(endpoints)}
+
+    def check(url):
+        up = False
+        try:
+            response = get_response(url, timeout, sockets)
+            up = getattr(response, 'status', None) in (200, 302)
+        finally:
+            lock.acquire()
+            try:
+                state['pending'] -= 1
+                if up:
+                    state['up'] = True
+                if up or not state['pending']:
+                    done.set()
+            finally:
+                lock.release()
+
+    for url in endpoints:
+        thread = threading.Thread(target=check, args=(url,))
+        thread.setDaemon(True)
+        thread.start()
+    done.wait(timeout + 1)
+
+    lock.acquire()
+    try:
+        reachable = state['up']
+    finally:
+        lock.release()
+    sockets.cancel()
+
+    _last_reachable[:] = [time.time(), reachable]
+    return reachable
+
+class LazyTwitter(object):
+    '''Twitter client that only imports and builds twitter.Api when the first
+    update is posted, so runs where nothing changed never load it.'''
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self._api = None
+
+    def PostUpdate(self, message):
+        if self._api is None:
+            import twitter
+            self._api = twitter.Api(username=self.username,
+                                    password=self.password)
+        return self._api.PostUpdate(message)
 
 class FluidDBConnection(object):
-    def __init__(self, shortname, url):
+    def __init__(self, shortname, url, target=None, pool=None, health=None):
         self.shortname = shortname
         self.url = url
+        self.target = target or shortname
+        self.pool = pool
+        self.host = urlparse.urlparse(url).hostname
+        self.health = health or HEALTH_DEFAULTS
+
+    def fluid(self):
+        '''Returns a fom session on this connection, logged in when the
+        [health] section has credentials'''
+        from fom.session import Fluid
+        fdb = Fluid(self.url, self.pool)
+        if self.health.get('username'):
+            fdb.db.client.login(self.health['username'],
+                                self.health['password'])
+        return fdb
+
+    def check_endpoint(self, endpoint, call, expected=(200,)):
+        '''Runs one fom call and turns its status into a probe result. A
+        call the host's circuit breaker turned away is a failure, as the
+        host is down as far as the breaker knows'''
+        from fom import breaker
+        name = '%s %s endpoint' % (self.shortname.capitalize(), endpoint)
+        try:
+            ret = call(self.fluid())
+        except breaker.CircuitOpenError:
+            return (False, '%s is down (circuit open)' % name)
+        except socket.error:
+            return (False, '%s is unreachable' % name)
+        except Exception:
+            return (False, 'Wrong thing happends on %s' % name)
+        if ret[0] not in expected:
+            return (False, '%s answers %s' % (name, ret[0]))
+        return (True, '%s is now working' % name, None)
+
+    def test_query(self):
+        "Check that objects can be queried"
+        query = self.health['query']
+        return self.check_endpoint('query',
+            lambda fluid: fluid.objects.get(query))
+
+    def test_namespace(self):
+        "Check that a namespace can be read"
+        namespace = self.health['namespace']
+        return self.check_endpoint('namespace',
+            lambda fluid: fluid.namespaces[namespace].get(
+                returnDescription=True, returnTags=True))
+
+    def test_permissions(self):
+        "Check that the permissions on our own namespace can be read"
+        namespace = self.health['username']
+        return self.check_endpoint('permissions',
+            lambda fluid: fluid.permissions.namespaces[namespace].get('list'))
+
+    def test_tag_value(self):
+        "Check a tag value round trip on a scratch object"
+        tag = self.health.get('scratch_tag',
+                              '%s/fluiddbstatus/scratch' % self.health['username'])
+        value = '%s %.3f' % (self.shortname, time.time())
+
+        def roundtrip(fluid):
+            status, response = fluid.objects.post(self.health['scratch_about'])
+            if status not in (200, 201):
+                return status, response
+            tagapi = fluid.objects[response[u'id']][tag]
+            status = tagapi.put(value)
+            if status != 204:
+                return status, None
+            status, stored, value_type = tagapi.get()
+            if status == 200 and stored != value:
+                return 'a stale value', stored
+            return status, stored
+        return self.check_endpoint('tag value', roundtrip)
 
     def test_user(self):
         "Check if fluiddb user exists"
-        fdb = Fluid(self.url)
+        from fom import breaker
+        from fom.session import Fluid
+        fdb = Fluid(self.url, self.pool)
         try:
             ret = fdb.__call__('GET', '/users/fluiddb')
             if ret[0] == 200:
                 return (True,
                         '%s instance is now reachable' % self.shortname.capitalize(),
                         ret[1]['id'])
+        except breaker.CircuitOpenError:
+            return (False, '%s instance is down (circuit open)' % self.shortname.capitalize())
         except socket.error:
             return (False, '%s instance is unreachable' % self.shortname.capitalize())
         except:
@@ -71,65 +646,265 @@ class FluidDBConnection(object):
         return (False, 'Wrong thing happends on %s instance' % self.shortname)
 
 
-maininstance_http = FluidDBConnection('main (http)', 'http://fluiddb.fluidinfo.com')
-maininstance_https = FluidDBConnection('main (https)', 'https://fluiddb.fluidinfo.com')
-sandbox_http = FluidDBConnection('sandbox (http)', 'http://sandbox.fluidinfo.com')
-sandbox_https = FluidDBConnection('sandbox (https)', 'http://sandbox.fluidinfo.com')
+# (probe name, FluidDBConnection method, message when its value changes)
+PROBES = [
+    ('user', 'test_user', 'FluidDB user on %s has changed id'),
+    ('query', 'test_query', 'FluidDB query on %s has changed'),
+    ('namespace', 'test_namespace', 'FluidDB namespace on %s has changed'),
+]
+# Probes that need the [health] credentials
+AUTHENTICATED_PROBES = [
+    ('permissions', 'test_permissions', 'FluidDB permissions on %s have changed'),
+    ('tag value', 'test_tag_value', 'FluidDB tag value on %s has changed'),
+]
+
+def get_option(config, section, option, default=None):
+    '''Returns an optional config value, or default when it is not set'''
+    if config.has_option(section, option):
+        return config.get(section, option)
+    return default
+
+def load_health(config):
+    '''Returns the [health] settings merged over HEALTH_DEFAULTS'''
+    health = dict(HEALTH_DEFAULTS)
+    if config.has_section('health'):
+        health.update(config.items('health'))
+    return health
+
+def load_probes(health):
+    '''Returns the probes to run, including the authenticated ones when
+    there are credentials to run them with'''
+    if health.get('username'):
+        return PROBES + AUTHENTICATED_PROBES
+    return PROBES
 
+def load_targets(config, health=None):
+    '''Builds a connection for every target in the [targets] section
+    (name = host) and every scheme in [core] schemes. The connections to a
+    host share one HttpPool, whatever their scheme.'''
+    from fom.db import HttpPool
+    if config.has_section('targets'):
+        targets = config.items('targets')
+    else:
+        targets = TARGETS
+    schemes = get_option(config, 'core', 'schemes')
+    if schemes:
+        schemes = schemes.split()
+    else:
+        schemes = SCHEMES
 
-tests = [
-    ('Test FluidDB user (http)', maininstance_http.test_user, 'FluidDB user on main has changed id'),
-    ('Test FluidDB user (https)', maininstance_https.test_user, 'FluidDB user on main has changed id'),
-    ('Test FluidDB Sandbox user (http)', sandbox_http.test_user, 'FluidDB user on sandbox has changed id'),
-    ('Test FluidDB Sandbox user (https)', sandbox_https.test_user, 'FluidDB user on sandbox has changed id'),
-        ]
+    pools = {}
+    connections = []
+    for target, host in targets:
+        pool = pools.setdefault(host, HttpPool())
+        for scheme in schemes:
+            connections.append(FluidDBConnection(
+                '%s (%s)' % (target, scheme), '%s://%s' % (scheme, host),
+                target, pool, health))
+    return connections
+
+def run_fanout(connections, probes=PROBES):
+    '''Runs every probe against every connection at once. Returns the
+    results grouped per host, as
+    {host: [(testname, ret, changedmsg, latency)]}.'''
+    results = {}
+    lock = threading.Lock()
+
+    def run(conn, probename, method, changedmsg):
+        testname = 'Test FluidDB %s on %s' % (probename, conn.shortname)
+        started = time.time()
+        try:
+            ret = getattr(conn, method)()
+        except Exception:
+            logging.exception('%s: probe crashed', testname)
+            ret = (False, 'Wrong thing happends on %s instance' % conn.shortname)
+        latency = time.time() - started
+        lock.acquire()
+        try:
+            results.setdefault(conn.host, []).append(
+                (testname, ret, changedmsg % conn.target, latency))
+        finally:
+            lock.release()
+
+    threads = []
+    for conn in connections:
+        for probe in probes:
+            thread = threading.Thread(target=run, args=(conn,) + probe)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    for hostresults in results.values():
+        hostresults.sort()
+    return results
+
+def run_tests(twit, pickle_file, endpoints, connections, probes=PROBES,
+              reachable_ttl=0, history=None, status=None):
+    '''Runs one probe round, adding the results to history and handing
+    them to the status server when there are those. Returns False if the
+    net is unreachable.'''
+    from fom import breaker
+    resolve_probe_hosts(endpoints + [conn.url for conn in connections])
+
+    if not is_internet_reachable(endpoints, ttl=reachable_ttl):
+        logging.error('Not connected to the net')
+        return False
+
+    pickledata = load_old_results(pickle_file)
+
+    results = run_fanout(connections, probes)
+    circuits = breaker.states()
+    pickledata['circuits'] = circuits
+    for host in sorted(results):
+        circuit = circuits.get(host)
+        if circuit and circuit['state'] != breaker.CLOSED:
+            logging.error('Results for %s (circuit %s after %d failures)',
+                          host, circuit['state'], circuit['failures'])
+        else:
+            logging.info('Results for %s', host)
+        for testname, ret, testchangedmsg, latency in results[host]:
+            record_stats(pickledata, testname, ret[0], latency)
+            if history is not None:
+                history.add(testname, bool(ret[0]), latency)
+            process_result(twit, pickledata, testname, ret, testchangedmsg)
+
+    store_results(pickle_file, pickledata)
+    if history is not None:
+        history.save()
+    if status is not None:
+        status.update(results, circuits)
+    return True
+
+def record_stats(pickledata, testname, passed, latency):
+    '''Keeps the run and error counts and the latest latencies of a test'''
+    stats = pickledata.setdefault('stats-' + testname, {
+        'count': 0, 'errors': 0, 'latencies': [], 'last_error': None})
+    stats['count'] += 1
+    if not passed:
+        stats['errors'] += 1
+        stats['last_error'] = time.time()
+    stats['latencies'] = (stats['latencies'] + [latency])[-STATS_SAMPLES:]
+    logging.info('%s: %.1f ms', testname, latency * 1000)
+
+def process_result(twit, pickledata, testname, ret, testchangedmsg):
+    '''Logs a probe result and posts status and value changes'''
+    pickleidx = 'laststatus-' + testname
+    if ret[0] is False:
+        testresult = 'fail'
+        logging.error('%s: fail', testname)
+    else:
+        testresult = 'pass'
+        logging.info('%s: passed!', testname)
+        
+
+    if pickleidx in pickledata and pickledata[pickleidx] != testresult:
+        twit.PostUpdate(ret[1])
+        logging.info(ret[1])
+        pickledata[pickleidx] = testresult
+
+    if testresult == 'pass':
+        pickleidx = 'change-' + testname 
+        if pickleidx in pickledata and pickledata[pickleidx] != ret[2]:
+            message = '%s: %s' % (testchangedmsg, ret[2])
+            twit.PostUpdate(message)
+            logging.info(message)
+        pickledata[pickleidx] = ret[2]
+
+def format_ms(latency):
+    if latency is None:
+        return '-'
+    return '%.1f' % (latency * 1000)
+
+def print_report(history, words, days):
+    '''Prints the availability and latencies over the last days of the
+    tests whose names contain every word, and of all of them together'''
+    since = time.time() - days * 86400
+    testnames = history.find(*words)
+    print '%-50s %8s %8s %9s %9s %9s' % (
+        'test (last %g days)' % days, 'probes', 'up %', 'p50 ms', 'p90 ms',
+        'p99 ms')
+    rows = [(testname, [testname]) for testname in testnames]
+    if len(testnames) > 1:
+        rows.append(('all of the above', testnames))
+    for name, tests in rows:
+        summary = history.summary(tests, since)
+        availability = summary['availability']
+        if availability is None:
+            availability = '-'
+        else:
+            availability = '%.3f' % (availability * 100)
+        print '%-50s %8d %8s %9s %9s %9s' % (
+            name, summary['count'], availability, format_ms(summary['p50']),
+            format_ms(summary['p90']), format_ms(summary['p99']))
 
 def main():
+    parser = optparse.OptionParser(usage='%prog [--report DAYS [WORD...]]')
+    parser.add_option('--report', type='float', metavar='DAYS',
+                      help='print the availability and latency over the '
+                           'last DAYS days of the tests matching every WORD, '
+                           'such as "sandbox https", and exit')
+    options, words = parser.parse_args()
+
     config = ConfigParser.RawConfigParser()
     config.read(os.path.join(os.path.expanduser('~'), '.fluiddbstatus.rc'))
 
+    pickle_file = config.get('core', 'datafile')
+    history = History.load(get_option(config, 'core', 'historyfile',
+                                      pickle_file + '.history'))
+    if options.report is not None:
+        print_report(history, words, options.report)
+        return
+
     twitterusername = config.get('twitter', 'username')
     twitterpassword = config.get('twitter', 'password')
-    pickle_file = config.get('core', 'datafile')
     log_file = config.get('core', 'logfile')
-    
+    endpoints = get_option(config, 'core', 'reference_endpoints')
+    if endpoints:
+        endpoints = endpoints.split()
+    else:
+        endpoints = REFERENCE_ENDPOINTS
+    # Seconds between probe rounds; without it a single round is run.
+    interval = float(get_option(config, 'core', 'interval', 0))
+    reachable_ttl = float(get_option(config, 'core', 'reachable_ttl',
+                                     REACHABLE_TTL))
+
     logging.basicConfig(level=logging.INFO, filename=log_file,
             format='%(asctime)s %(levelname)s: %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S')
 
-    if not is_internet_reachable():
-        logging.error('Not connected to the net')
-        exit(1)
-
-    pickledata = load_old_results(pickle_file)
+    twit = LazyTwitter(twitterusername, twitterpassword)
+    health = load_health(config)
+    probes = load_probes(health)
+    connections = load_targets(config, health)
 
-    twit = twitter.Api(username=twitterusername, password=twitterpassword)
+    if not interval:
+        if not run_tests(twit, pickle_file, endpoints, connections, probes,
+                         history=history):
+            exit(1)
+        return
 
-    for testname, testfunc, testchangedmsg in tests:
-        ret = testfunc()
-        pickleidx = 'laststatus-' + testname
-        if ret[0] is False:
-            testresult = 'fail'
-            logging.error('%s: fail', testname)
-        else:
-            testresult = 'pass'
-            logging.info('%s: passed!', testname)
-            
-
-        if pickleidx in pickledata and pickledata[pickleidx] != testresult:
-            twit.PostUpdate(ret[1])
-            logging.info(ret[1])
-            pickledata[pickleidx] = testresult
-
-        if testresult == 'pass':
-            pickleidx = 'change-' + testname 
-            if pickleidx in pickledata and pickledata[pickleidx] != ret[2]:
-                message = '%s: %s' % (testchangedmsg, ret[2])
-                twit.PostUpdate(message)
-                logging.info(message)
-            pickledata[pickleidx] = ret[2]
+    # The status server only runs between probe rounds, with an interval
+    status = None
+    status_port = get_option(config, 'status', 'port')
+    if status_port:
+        status = StatusServer(history,
+                              get_option(config, 'status', 'host', '127.0.0.1'),
+                              int(status_port))
+        status.start()
+        logging.info('Serving status on port %s', status_port)
 
-    store_results(pickle_file, pickledata)
+    while True:
+        started = time.time()
+        try:
+            run_tests(twit, pickle_file, endpoints, connections, probes,
+                      reachable_ttl, history, status)
+        except Exception:
+            # A failed post or write must not stop the daemon, nor the
+            # status server with it
+            logging.exception('Probe round failed')
+        time.sleep(max(0, interval - (time.time() - started)))
 
 if __name__ == '__main__':
     main()
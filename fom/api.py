@@ -31,22 +31,29 @@ TODO:
 """
 
 
+from fom.query import QueryError, RemoteQueryError
+
+
 class ApiBase(object):
     """Base class for an api component.
 
     Stores the db instance as state and uses it to call the required call.
+
+    Components for a single item set ``full_path`` once, and calls made
+    without a path go to it.
     """
 
+    #: The path calls without a path go to, if not root_path.
+    full_path = None
+
     def __init__(self, db):
         self.db = db
 
     def _make_path(self, path):
         if path is None:
-            path = self.root_path
-        else:
-            path = '/'.join([self.root_path, path])
-        return path
-    
+            return self.full_path or self.root_path
+        return '/'.join([self.root_path, path])
+
     def __call__(self, method, path=None, payload=None, urlargs=None, **kw):
         path = self._make_path(path)
         return self.db(method, path, payload, urlargs, **kw)
@@ -59,6 +66,35 @@ class ApiBase(object):
         path = self._make_path(path)
         return self.db.get_value(path)
 
+    def get_value_stream(self, fileobj, path=None):
+        path = self._make_path(path)
+        return self.db.get_value_stream(path, fileobj)
+
+    def get_value_into(self, buffer, path=None):
+        path = self._make_path(path)
+        return self.db.get_value_into(path, buffer)
+
+    def put_value_stream(self, source, value_type, length=None, path=None):
+        path = self._make_path(path)
+        return self.db.put_value_stream(path, source, value_type, length)
+
+
+class ContainerApi(ApiBase):
+    """Base class for an api component handing out components for items.
+
+    A new component is made on each lookup; components are cheap, and
+    callers using one repeatedly keep it (as :mod:`fom.mapping` does).
+    """
+
+    #: The class of the components, made with (key, db).
+    component_type = None
+
+    def _new_component(self, key):
+        return self.component_type(key, self.db)
+
+    def __getitem__(self, key):
+        return self._new_component(key)
+
 
 class UserApi(ApiBase):
     """API component for a single user.
@@ -70,24 +106,24 @@ class UserApi(ApiBase):
     def __init__(self, username, db):
         self.username = username
         self.db = db
+        self.full_path = '/'.join([self.root_path, username])
 
     def get(self):
         """Return information about the user.
 
         http://api.fluidinfo.com/fluidDB/api/*/users/GET
         """
-        return self('GET', self.username)
+        return self('GET')
 
 
-class UsersApi(ApiBase):
+class UsersApi(ContainerApi):
     """API component for users.
 
     This is a container API that handles getting the path for individual
     users.
     """
 
-    def __getitem__(self, key):
-        return UserApi(key, self.db)
+    component_type = UserApi
 
 
 class ObjectTagApi(ApiBase):
@@ -102,34 +138,57 @@ class ObjectTagApi(ApiBase):
         self.uid = uid
         self.path = '/'.join([self.uid, tagpath])
         self.db = db
+        self.full_path = '/'.join([self.root_path, self.path])
 
     def get(self):
         """Call GET on an individual object's tag.
 
         .. seealso:: `<http://api.fluidinfo.com/fluidDB/api/*/objects/GET>`_
         """
-        return self.get_value(self.path)
+        return self.get_value()
 
     def head(self):
         """Call HEAD on an individial object's tag.
 
         .. seealso:: `<http://api.fluidinfo.com/fluidDB/api/*/objects/HEAD>`_
         """
-        return self('HEAD', self.path)
+        return self('HEAD')
 
     def delete(self):
         """Call DELETE on an individual object's tag.
 
         .. seealso:: `<http://api.fluidinfo.com/fluidDB/api/*/objects/DELETE>`_
         """
-        return self('DELETE', self.path)
+        return self('DELETE')
 
     def put(self, value, value_type=None):
         """Call PUT on an individual object's tag.
 
         http://api.fluidinfo.com/fluidDB/api/*/objects/PUT
         """
-        return self.put_value(self.path, value, value_type)
+        return self.put_value(None, value, value_type)
+
+    def get_stream(self, fileobj):
+        """Call GET on an individual object's tag, writing the value to a
+        file-like object in chunks instead of returning it.
+
+        :returns: (status, content type, bytes written)
+        """
+        return self.get_value_stream(fileobj)
+
+    def get_into(self, buffer):
+        """Call GET on an individual object's tag, reading the value into a
+        writable buffer such as a bytearray.
+
+        :returns: (status, content type, bytes read)
+        """
+        return self.get_value_into(buffer)
+
+    def put_stream(self, source, value_type, length=None):
+        """Call PUT on an individual object's tag, uploading the value from
+        a file-like object or a buffer such as an mmap.
+        """
+        return self.put_value_stream(source, value_type, length)
 
 
 class ObjectApi(ApiBase):
@@ -140,32 +199,79 @@ class ObjectApi(ApiBase):
 
     root_path = '/objects'
 
+    _full_path = None
+    # Tag components, made on the first lookup of a tag. Kept so callers
+    # holding on to the object's component get them for free.
+    _tags = None
+
     def __init__(self, uid, db):
         self.uid = uid
         self.db = db
 
+    @property
+    def full_path(self):
+        """The object's path, worked out on first use. None while there is
+        no uid (an object not created yet), so calls go to root_path.
+        """
+        if self._full_path is None and self.uid is not None:
+            self._full_path = '/'.join([self.root_path, self.uid])
+        return self._full_path
+
     def get(self, showAbout=False):
         """Call GET on an individual object.
 
         http://api.fluidinfo.com/fluidDB/api/*/objects/GET
         """
-        return self('GET', self.uid, urlargs={'showAbout':showAbout})
+        return self('GET', urlargs={'showAbout':showAbout})
+
+    def get_values(self, tagpaths):
+        """Get the values of several of the object's tags at once, pipelined
+        when the client's ``pipeline`` is set.
+
+        :returns: A list of (status, value, value type), one per tag path.
+        """
+        return self.db.get_values(['/'.join([self.full_path, tagpath])
+                                   for tagpath in tagpaths])
 
     def __getitem__(self, tagpath):
-        return ObjectTagApi(self.uid, tagpath, self.db)
+        tags = self._tags
+        if tags is None:
+            tags = self._tags = {}
+        else:
+            component = tags.get(tagpath)
+            if component is not None:
+                return component
+        component = tags[tagpath] = ObjectTagApi(self.uid, tagpath, self.db)
+        return component
 
 
-class ObjectsApi(ApiBase):
+class ObjectsApi(ContainerApi):
     """API Component for the /objects toplevel
+
+    Dict-like access gives the component for an object by ID.
     """
 
     root_path = '/objects'
+    component_type = ObjectApi
 
     def get(self, query):
         """Call GET on the /objects toplevel
 
         http://api.fluidinfo.com/fluidDB/api/*/objects/GET
+
+        With a replica attached to the database (see :mod:`fom.replica`) the
+        query is answered from it where possible. Only a query the replica
+        cannot parse is sent to FluidDB as it is; when the parts it sent
+        fail, FluidDB's answer is returned.
         """
+        replica = getattr(self.db, 'replica', None)
+        if replica is not None:
+            try:
+                return 200, {u'ids': replica.query(query)}
+            except RemoteQueryError, e:
+                return e.status, e.response
+            except QueryError:
+                pass
         return self('GET', path=None, payload=None, urlargs={'query': query})
 
     def post(self, about=None):
@@ -181,11 +287,6 @@ class ObjectsApi(ApiBase):
             payload[u'about'] = about
         return self('POST', path=None, payload=payload)
 
-    def __getitem__(self, key):
-        """Dict-like access for objects by ID.
-        """
-        return ObjectApi(key, self.db)
-
 
 class NamespaceApi(ApiBase):
     """API Component for a single Namespace.
@@ -207,6 +308,7 @@ class NamespaceApi(ApiBase):
     def __init__(self, path, db):
         self.db = db
         self.path = path
+        self.full_path = '/'.join([self.root_path, path])
 
     def get(self, returnDescription=False, returnNamespaces=False,
                   returnTags=False):
@@ -220,7 +322,7 @@ class NamespaceApi(ApiBase):
             'returnNamespaces': returnNamespaces,
             'returnTags': returnTags,
         }
-        return self('GET', self.path, urlargs=urlargs)
+        return self('GET', urlargs=urlargs)
 
     def post(self, name, description):
         """
@@ -228,7 +330,7 @@ class NamespaceApi(ApiBase):
 
         http://api.fluidinfo.com/fluidDB/api/*/namespaces/POST
         """
-        return self('POST', self.path, {'name':name, 'description':description})
+        return self('POST', None, {'name':name, 'description':description})
 
     def delete(self):
         """
@@ -236,7 +338,7 @@ class NamespaceApi(ApiBase):
 
         http://api.fluidinfo.com/fluidDB/api/*/namespaces/DELETE
         """
-        return self('DELETE', self.path)
+        return self('DELETE')
 
     def put(self, description):
         """
@@ -244,21 +346,16 @@ class NamespaceApi(ApiBase):
 
         http://api.fluidinfo.com/fluidDB/api/*/namespaces/PUT
         """
-        return self('PUT', self.path, {u'description': description})
+        return self('PUT', None, {u'description': description})
 
 
-class NamespacesApi(ApiBase):
+class NamespacesApi(ContainerApi):
     """API Component for the /namespaces target.
 
-    Provides no methods, only access to named namespaces.
+    Provides no methods, only dict-like access to named namespaces by path.
     """
 
-    def __getitem__(self, key):
-        """Dict-like access.
-
-        Returns an API component for the namespace path in key.
-        """
-        return NamespaceApi(key, self.db)
+    component_type = NamespaceApi
 
 
 #TODO
@@ -271,32 +368,31 @@ class TagApi(ApiBase):
     def __init__(self, path, db):
         self.path = path
         self.db = db
+        self.full_path = '/'.join([self.root_path, path])
 
     def get(self, returnDescription=False):
-        return self('GET', self.path,
+        return self('GET',
             urlargs={u'returnDescription': returnDescription})
 
     def post(self, name, description, indexed):
-        return self('POST', self.path, payload=
+        return self('POST', payload=
             {u'name': name, u'description': description, u'indexed': indexed})
 
     def delete(self):
-        return self('DELETE', self.path)
+        return self('DELETE')
 
     def put(self, description):
-        return self('PUT', self.path, payload={u'description': description})
+        return self('PUT', payload={u'description': description})
 
 
-class TagsApi(ApiBase):
+class TagsApi(ContainerApi):
     """API Component for /tags toplevel.
+
+    Dict-like access gives the API component for the tag with a path.
     """
 
     root_path = '/tags'
-
-    def __getitem__(self, key):
-        """Get the API component for the tag with the given path.
-        """
-        return TagApi(key, self.db)
+    component_type = TagApi
 
 
 class ItemPermissionsApi(ApiBase):
@@ -307,25 +403,26 @@ class ItemPermissionsApi(ApiBase):
         self.root_path = root_path
         self.path = path
         self.db = db
+        self.full_path = '/'.join([root_path, path])
 
     def put(self, action, policy, exceptions):
-        return self('PUT', self.path,
+        return self('PUT',
             payload={u'policy': policy, u'exceptions': exceptions},
             urlargs={u'action': action})
 
     def get(self, action):
-        return self('GET', self.path, urlargs={u'action': action})
+        return self('GET', urlargs={u'action': action})
 
 
-class ItemsPermissionsApi(ApiBase):
+class ItemsPermissionsApi(ContainerApi):
     """API component for all groups of permissions for a type of toplevel.
     """
 
     def __init__(self, root_path, db):
+        ContainerApi.__init__(self, db)
         self.root_path = root_path
-        self.db = db
 
-    def __getitem__(self, key):
+    def _new_component(self, key):
         return ItemPermissionsApi(self.root_path, key, self.db)
 
 
@@ -352,6 +449,7 @@ class PolicyApi(ApiBase):
         self.username = username
         self.category = category
         self.action = action
+        self.full_path = '/'.join([self.root_path, self.path])
 
     @property
     def path(self):
@@ -366,7 +464,7 @@ class PolicyApi(ApiBase):
 
             `<http://api.fluidinfo.com/fluidDB/api/*/policies/GET>`_
         """
-        return self('GET', self.path)
+        return self('GET')
 
     def put(self, policy, exceptions):
         """Call put on the policy.
@@ -375,21 +473,24 @@ class PolicyApi(ApiBase):
 
             `<http://api.fluidinfo.com/fluidDB/api/*/policies/PUT>`_
         """
-        return self('PUT', self.path, payload={u'policy': policy,
+        return self('PUT', payload={u'policy': policy,
                                                u'exceptions':exceptions})
 
 
-class PoliciesApi(ApiBase):
+class PoliciesApi(ContainerApi):
     """API Component for the /policies toplevel.
     """
 
     root_path = '/policies'
 
+    def _new_component(self, key):
+        username, category, action = key
+        return PolicyApi(username, category, action, self.db)
+
     def __getitem__(self, key):
         # key should be a tuple of username, category, action
         if len(key) == 3:
-            username, category, action = key
-            return PolicyApi(username, category, action, self.db)
+            return ContainerApi.__getitem__(self, key)
 
 
 class FluidApi(object):
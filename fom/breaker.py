@@ -0,0 +1,169 @@
+
+"""
+fom.breaker
+===========
+
+Per-host circuit breakers for :class:`fom.db.FluidDB`.
+
+After ``failure_threshold`` consecutive failures (network errors or 5xx
+answers) the circuit for a host opens and calls fail immediately with
+:class:`CircuitOpenError` instead of waiting for a socket timeout. Once
+``reset_timeout`` seconds have passed it is half-open: a single trial call
+goes through, and closes the circuit again if it succeeds or re-opens it if
+it fails.
+
+Breakers are shared by every FluidDB instance for the same host, and their
+state can be read with :func:`states`:
+
+>>> from fom import breaker
+>>> breaker.states()
+{'fluiddb.fluidinfo.com': {'state': 'closed', 'failures': 0, ...}}
+
+"""
+
+import httplib
+import socket
+import threading
+import time
+import urlparse
+
+import httplib2
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+#: Exceptions counted as a failure of the host.
+FAILURES = (socket.error, httplib.HTTPException, httplib2.HttpLib2Error)
+
+
+class CircuitOpenError(socket.error):
+    """Raised instead of calling a host whose circuit is open.
+
+    It is a ``socket.error`` so code that already handles unreachable hosts
+    handles it too.
+    """
+
+
+class CircuitBreaker(object):
+    """The circuit for one host.
+
+    .. attribute:: state
+
+        One of :data:`CLOSED`, :data:`OPEN` or :data:`HALF_OPEN`.
+    """
+
+    def __init__(self, host, failure_threshold=5, reset_timeout=30):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Let a call through or raise :class:`CircuitOpenError`.
+        """
+        self._lock.acquire()
+        try:
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError(
+                        'Circuit for %s is open' % self.host)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._trial:
+                    raise CircuitOpenError(
+                        'Circuit for %s is half-open, trial in progress'
+                        % self.host)
+                self._trial = True
+        finally:
+            self._lock.release()
+
+    def record_success(self):
+        self._lock.acquire()
+        try:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial = False
+        finally:
+            self._lock.release()
+
+    def record_failure(self):
+        self._lock.acquire()
+        try:
+            self.failures += 1
+            if self.state == HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+            self._trial = False
+        finally:
+            self._lock.release()
+
+    def call(self, func, *args, **kw):
+        """Call func through the breaker.
+
+        func should return a status code, or a tuple starting with one.
+        """
+        self.before_call()
+        try:
+            result = func(*args, **kw)
+        except FAILURES:
+            self.record_failure()
+            raise
+        except:
+            # Not the host's fault, but a half-open trial must not stay
+            # pending forever.
+            self._lock.acquire()
+            self._trial = False
+            self._lock.release()
+            raise
+        if isinstance(result, tuple):
+            status = result[0]
+        else:
+            status = result
+        if status >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+    def snapshot(self):
+        """Return the state of the circuit as a dict.
+        """
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opened_at': self.opened_at,
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url):
+    """Return the breaker for the host of a URL, creating it when needed.
+    """
+    host = urlparse.urlparse(url).hostname or url
+    _breakers_lock.acquire()
+    try:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+    finally:
+        _breakers_lock.release()
+
+
+def states():
+    """Return a snapshot of every breaker, keyed by host.
+    """
+    _breakers_lock.acquire()
+    try:
+        breakers = _breakers.items()
+    finally:
+        _breakers_lock.release()
+    return dict((host, breaker.snapshot()) for host, breaker in breakers)
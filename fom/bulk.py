@@ -0,0 +1,642 @@
+
+"""
+fom.bulk
+========
+
+Bulk loading and exporting of FluidDB objects and tags.
+
+Loading
+-------
+
+Rows are streamed from a CSV file (a header row naming the ``about`` column
+and one column per tag path) or a JSONL file (one object per line with an
+``about`` key and tag path keys). Each row becomes an object with that about
+value and the given tag values, written by a bounded pool of worker threads
+sharing one connection pool.
+
+Rows that cannot be parsed are logged and skipped. Progress is checkpointed
+to a file so an interrupted load resumes where it stopped, and the rate is
+logged as it goes::
+
+    python -m fom.bulk load data.csv --url http://fluiddb.fluidinfo.com \\
+        --username test --password test --workers 16 --checkpoint data.ckpt
+
+Exporting
+---------
+
+The objects matching a query are exported with their tag values, fetched
+concurrently and written out as they arrive, so memory use does not grow
+with the size of the result. The output is either JSONL (one object per
+line, with an ``id`` key) or a compact columnar file with one column per tag
+(see :class:`ColumnarWriter`)::
+
+    python -m fom.bulk export 'has test/rating' out.jsonl --tags test/rating
+
+Decoding the values holds the GIL, so a large export can be spread over
+processes as well, each with its own session (see :mod:`fom.shard`)::
+
+    python -m fom.bulk export 'has test/rating' out.jsonl --processes 4
+
+"""
+
+import csv
+import functools
+import logging
+import optparse
+import os
+import Queue
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from fom import codec
+from fom.db import HttpPool
+from fom.retry import RetryPolicy
+from fom.session import Fluid
+
+ABOUT = 'about'
+
+log = logging.getLogger('fom.bulk')
+
+
+def read_csv(fileobj, about=ABOUT):
+    """Yield (about, {tag path: value}) for each row of a CSV file.
+
+    Empty cells are skipped; values are sent as strings. Rows with more
+    cells than the header or with text that is not UTF-8 are logged and
+    skipped.
+    """
+    reader = csv.DictReader(fileobj)
+    for row in reader:
+        if None in row:
+            log.error('Skipping line %d: more cells than columns',
+                      reader.line_num)
+            continue
+        about_value = row.pop(about, None) or None
+        try:
+            tags = dict((tag, value.decode('utf-8'))
+                        for tag, value in row.iteritems() if value)
+            about_value = about_value and about_value.decode('utf-8')
+        except UnicodeDecodeError, e:
+            log.error('Skipping line %d: %s', reader.line_num, e)
+            continue
+        yield about_value, tags
+
+
+def read_jsonl(fileobj, about=ABOUT):
+    """Yield (about, {tag path: value}) for each line of a JSONL file.
+
+    Lines that are not a JSON object are logged and skipped.
+    """
+    for number, line in enumerate(fileobj, 1):
+        if not line.strip():
+            continue
+        try:
+            row = codec.loads(line)
+        except ValueError, e:
+            log.error('Skipping line %d: %s', number, e)
+            continue
+        if not isinstance(row, dict):
+            log.error('Skipping line %d: not a JSON object', number)
+            continue
+        about_value = row.pop(about, None)
+        yield about_value, row
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+class WorkerPool(object):
+    """Calls func on items from a bounded queue, on a fixed number of threads.
+
+    :meth:`put` blocks while the backlog is full, so a fast producer cannot
+    run ahead of the workers and fill memory. An exception from func is
+    logged and the worker goes on with the next item.
+    """
+
+    _stop = object()
+
+    def __init__(self, func, workers=8, backlog=None):
+        self.func = func
+        self.queue = Queue.Queue(backlog or workers * 4)
+        self.threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is self._stop:
+                return
+            try:
+                self.func(item)
+            except Exception:
+                log.exception('Processing %r failed', item)
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def join(self):
+        """Wait for the queued items to be processed and stop the workers.
+        """
+        for thread in self.threads:
+            self.queue.put(self._stop)
+        for thread in self.threads:
+            thread.join()
+
+
+class Checkpoint(object):
+    """Records how many leading items of a run are complete.
+
+    Items finish out of order, so the checkpoint is the length of the run of
+    items that are all done, and the ones done beyond it are kept aside
+    until the gap closes.
+
+    A failed item counts as done too, so one that always fails does not hold
+    the checkpoint back; its index is kept in :attr:`failed`, saved one per
+    line next to the checkpoint in ``path + '.failed'``.
+    """
+
+    def __init__(self, path=None, every=1000):
+        self.path = path
+        self.every = every
+        self.done = 0
+        self.failed = set()
+        self._ahead = set()
+        self._since_save = 0
+        self._lock = threading.Lock()
+        if path and os.path.isfile(path):
+            self.done = int(open(path).read().strip() or 0)
+        if path and os.path.isfile(path + '.failed'):
+            self.failed = set(int(line) for line in open(path + '.failed')
+                              if line.strip())
+
+    def complete(self, index, ok=True):
+        self._lock.acquire()
+        try:
+            if ok:
+                self.failed.discard(index)
+            else:
+                self.failed.add(index)
+            if index >= self.done:
+                self._ahead.add(index)
+            while self.done in self._ahead:
+                self._ahead.remove(self.done)
+                self.done += 1
+            self._since_save += 1
+            if self._since_save >= self.every:
+                self._save()
+        finally:
+            self._lock.release()
+
+    def save(self):
+        self._lock.acquire()
+        try:
+            self._save()
+        finally:
+            self._lock.release()
+
+    def _save(self):
+        self._since_save = 0
+        if not self.path:
+            return
+        self._write(self.path + '.failed',
+                    ''.join('%d\n' % index for index in sorted(self.failed)))
+        self._write(self.path, '%d\n' % self.done)
+
+    def _write(self, path, data):
+        tmp = path + '.tmp'
+        out = open(tmp, 'w')
+        out.write(data)
+        out.close()
+        os.rename(tmp, path)
+
+
+class Progress(object):
+    """Counts processed items and errors and logs the rate.
+    """
+
+    def __init__(self, what='rows', interval=5):
+        self.what = what
+        self.interval = interval
+        self.count = 0
+        self.errors = 0
+        self.started = time.time()
+        self._reported = self.started
+        self._lock = threading.Lock()
+
+    def add(self, ok=True):
+        self._lock.acquire()
+        try:
+            self.count += 1
+            if not ok:
+                self.errors += 1
+            now = time.time()
+            if now - self._reported >= self.interval:
+                self._reported = now
+                self.report()
+        finally:
+            self._lock.release()
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.started
+        return elapsed and self.count / elapsed or 0.0
+
+    def report(self):
+        log.info('%d %s, %d errors, %.1f %s/s', self.count, self.what,
+                 self.errors, self.rate, self.what)
+
+
+def load_row(fluid, about, tags):
+    """Create (or find) the object about ``about`` and set its tags.
+
+    :returns: True if every write succeeded.
+    """
+    status, response = fluid.objects.post(about)
+    if status not in (200, 201):
+        log.error('Creating object about %r failed: %s', about, status)
+        return False
+    objapi = fluid.objects[response[u'id']]
+    ok = True
+    for tag, value in tags.iteritems():
+        status = objapi[tag].put(value)
+        if status != 204:
+            log.error('Setting %s on %s failed: %s', tag, response[u'id'],
+                      status)
+            ok = False
+    return ok
+
+
+def load(fluid, rows, workers=8, checkpoint=None, progress=None):
+    """Load (about, tags) rows into FluidDB with a pool of workers.
+
+    Rows before ``checkpoint.done`` are skipped, so a load can be resumed,
+    except for those in ``checkpoint.failed``: a resumed load tries the
+    rows that failed again.
+
+    :returns: The :class:`Progress` of the load.
+    """
+    if checkpoint is None:
+        checkpoint = Checkpoint()
+    if progress is None:
+        progress = Progress()
+
+    def work(item):
+        index, (about, tags) = item
+        try:
+            ok = load_row(fluid, about, tags)
+        except Exception:
+            log.exception('Row %d failed', index)
+            ok = False
+        progress.add(ok)
+        checkpoint.complete(index, ok)
+
+    pool = WorkerPool(work, workers)
+    try:
+        for index, row in enumerate(rows):
+            if index < checkpoint.done and index not in checkpoint.failed:
+                continue
+            pool.put((index, row))
+    finally:
+        # Rows already queued are finished and recorded even when reading
+        # the input fails.
+        pool.join()
+        checkpoint.save()
+        progress.report()
+    return progress
+
+
+def export_value(value, value_type):
+    """Return a tag value in a JSON friendly form. Primitive values are
+    returned as they are, opaque ones as a dict with their MIME type and
+    base64 encoded content.
+    """
+    if value_type is None:
+        return value
+    return {u'valueType': value_type,
+            u'base64': value.encode('base64').replace('\n', '')}
+
+
+def fetch_object(fluid, uid, tags=None):
+    """Return {tag path: value} for an object. Missing tags are left out.
+
+    :param tags: The tag paths to fetch, or None for all of the object's tags.
+    """
+    objapi = fluid.objects[uid]
+    if tags is None:
+        status, response = objapi.get()
+        if status != 200:
+            raise ValueError('Listing tags of %s failed: %s' % (uid, status))
+        tags = response[u'tagPaths']
+    values = {}
+    for tag, (status, value, value_type) in zip(tags,
+                                                objapi.get_values(tags)):
+        if status == 200:
+            values[tag] = export_value(value, value_type)
+    return values
+
+
+def _fetch_or_none(fluid, uid, tags=None):
+    try:
+        return fetch_object(fluid, uid, tags)
+    except Exception:
+        log.exception('Fetching %s failed', uid)
+        return None
+
+
+def _configure(fluid, retry=False, pipeline=0):
+    """Give a shard process's session the settings of the parent's.
+    """
+    if retry:
+        fluid.db.client.retry = RetryPolicy()
+    fluid.db.client.pipeline = pipeline
+
+
+class JsonlWriter(object):
+    """Writes each object as a JSON line with an ``id`` key.
+    """
+
+    def __init__(self, fileobj, tags=None):
+        self.fileobj = fileobj
+
+    def write(self, uid, values):
+        row = dict(values)
+        row[u'id'] = uid
+        self.fileobj.write(codec.dumps(row) + '\n')
+
+    def close(self):
+        self.fileobj.flush()
+
+
+COLUMNAR_MAGIC = 'FOMCOL1\n'
+_UINT32 = struct.Struct('>I')
+
+
+class ColumnarWriter(object):
+    """Writes objects in row groups, one compressed column per tag.
+
+    The layout is::
+
+        magic
+        uint32 length, JSON header: {"columns": ["id", tag, ...]}
+        for each row group:
+            uint32 row count
+            for each column:
+                uint32 length, zlib compressed JSON array of values
+        uint32 length, JSON footer: {"groups": [offset, ...], "rows": n}
+        uint32 footer length, magic
+
+    Only one row group is held in memory at a time. Missing values are null.
+    :func:`read_columnar` reads the file back.
+    """
+
+    def __init__(self, fileobj, tags, group_size=4096):
+        if not tags:
+            raise ValueError('Columnar output needs the list of tags')
+        self.fileobj = fileobj
+        self.columns = [u'id'] + list(tags)
+        self.group_size = group_size
+        self.rows = 0
+        self.groups = []
+        self._pending = []
+        fileobj.write(COLUMNAR_MAGIC)
+        self._write_block(codec.dumps({u'columns': self.columns}))
+
+    def _write_block(self, data):
+        self.fileobj.write(_UINT32.pack(len(data)))
+        self.fileobj.write(data)
+
+    def write(self, uid, values):
+        values = dict(values)
+        values[u'id'] = uid
+        self._pending.append([values.get(c) for c in self.columns])
+        if len(self._pending) >= self.group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        self.groups.append(self.fileobj.tell())
+        self.fileobj.write(_UINT32.pack(len(self._pending)))
+        for column in zip(*self._pending):
+            self._write_block(zlib.compress(codec.dumps(list(column))))
+        self.rows += len(self._pending)
+        self._pending = []
+
+    def close(self):
+        self._flush()
+        footer = codec.dumps({u'groups': self.groups, u'rows': self.rows})
+        self._write_block(footer)
+        self.fileobj.write(_UINT32.pack(len(footer)) + COLUMNAR_MAGIC)
+        self.fileobj.flush()
+
+
+def read_columnar(fileobj, columns=None):
+    """Yield {column: [values]} for each row group of a columnar export,
+    decompressing only the requested columns.
+    """
+    if fileobj.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError('Not a fom columnar file')
+
+    def read_block():
+        length, = _UINT32.unpack(fileobj.read(_UINT32.size))
+        return fileobj.read(length)
+
+    names = codec.loads(read_block())[u'columns']
+    fileobj.seek(-(_UINT32.size + len(COLUMNAR_MAGIC)), os.SEEK_END)
+    footer_length, = _UINT32.unpack(fileobj.read(_UINT32.size))
+    fileobj.seek(-(2 * _UINT32.size + len(COLUMNAR_MAGIC) + footer_length),
+                 os.SEEK_END)
+    groups = codec.loads(read_block())[u'groups']
+    for offset in groups:
+        fileobj.seek(offset + _UINT32.size)
+        group = {}
+        for name in names:
+            length, = _UINT32.unpack(fileobj.read(_UINT32.size))
+            if columns is None or name in columns:
+                group[name] = codec.loads(zlib.decompress(
+                    fileobj.read(length)))
+            else:
+                fileobj.seek(length, os.SEEK_CUR)
+        yield group
+
+
+WRITERS = {
+    'jsonl': JsonlWriter,
+    'columnar': ColumnarWriter,
+}
+
+
+def export(fluid, query, writer, tags=None, workers=8, progress=None,
+           processes=None):
+    """Export the objects matching query to writer.
+
+    Objects are fetched by a pool of workers and handed to a single writer
+    thread through bounded queues, so only a few objects are in memory at
+    once whatever the size of the result.
+
+    :param processes: Spread the fetching over this many processes, each
+        with workers threads and its own session like fluid.
+    :returns: The :class:`Progress` of the export.
+    """
+    if progress is None:
+        progress = Progress('objects')
+    status, response = fluid.objects.get(query)
+    if status != 200:
+        raise ValueError('Query %r failed: %s' % (query, status))
+    if processes:
+        return _export_sharded(fluid, response[u'ids'], writer, tags,
+                               workers, progress, processes)
+
+    results = Queue.Queue(workers * 4)
+    done = object()
+    errors = []
+
+    def work(uid):
+        if errors:
+            # The export has failed; skip the fetch, the writer drains.
+            return
+        results.put((uid, _fetch_or_none(fluid, uid, tags)))
+
+    def write():
+        while True:
+            item = results.get()
+            if item is done:
+                return
+            if errors:
+                continue
+            uid, values = item
+            try:
+                if values is not None:
+                    writer.write(uid, values)
+            except Exception:
+                # Keep draining, so the workers never block on the queue.
+                errors.append(sys.exc_info())
+                continue
+            progress.add(values is not None)
+
+    writer_thread = threading.Thread(target=write)
+    writer_thread.start()
+    pool = WorkerPool(work, workers)
+    for uid in response[u'ids']:
+        pool.put(uid)
+    pool.join()
+    results.put(done)
+    writer_thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    writer.close()
+    progress.report()
+    return progress
+
+
+def _export_sharded(fluid, ids, writer, tags, workers, progress, processes):
+    from fom.shard import ShardPool
+
+    setup = functools.partial(_configure,
+                              retry=fluid.db.client.retry is not None,
+                              pipeline=fluid.db.client.pipeline)
+    shards = ShardPool.like(fluid, processes, setup=setup,
+                            pool_size=workers, threads=workers)
+    try:
+        fetch = functools.partial(_fetch_or_none, tags=tags)
+        for uid, values in shards.imap_unordered(fetch, ids):
+            if values is not None:
+                writer.write(uid, values)
+            progress.add(values is not None)
+    except:
+        shards.terminate()
+        raise
+    shards.close()
+    writer.close()
+    progress.report()
+    return progress
+
+
+def connect(options):
+    """Return a session for the command line options, with a connection
+    pool sized for the workers and retries for idempotent requests.
+    """
+    fluid = Fluid(options.url, HttpPool(size=options.workers))
+    fluid.db.client.retry = RetryPolicy()
+    fluid.db.client.pipeline = options.pipeline
+    if options.username:
+        fluid.db.client.login(options.username, options.password)
+    return fluid
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(
+        usage='%prog load FILE [options]\n'
+              '       %prog export QUERY FILE [options]')
+    parser.add_option('--url', default='http://fluiddb.fluidinfo.com')
+    parser.add_option('--username')
+    parser.add_option('--password')
+    parser.add_option('--workers', type='int', default=8)
+    parser.add_option('--pipeline', type='int', default=0,
+                      help='export: pipeline up to this many tag GETs per '
+                           'object on one connection')
+    parser.add_option('--processes', type='int',
+                      help='export: spread fetching over this many '
+                           'processes, each with --workers threads')
+    parser.add_option('--format', choices=READERS.keys() + WRITERS.keys(),
+                      help='file format, guessed from the file extension '
+                           'by default')
+    parser.add_option('--about', default=ABOUT,
+                      help='name of the column holding the about value')
+    parser.add_option('--checkpoint',
+                      help='file to record progress in and resume from')
+    parser.add_option('--tags',
+                      help='comma separated tag paths to export; all of '
+                           'each object\'s tags by default (jsonl only)')
+    options, args = parser.parse_args(argv)
+    if args[:1] == ['load'] and len(args) == 2:
+        command, path = args
+        formats = READERS
+    elif args[:1] == ['export'] and len(args) == 3:
+        command, query, path = args
+        formats = WRITERS
+    else:
+        parser.error('expected load FILE or export QUERY FILE')
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s: %(message)s')
+
+    fmt = options.format or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in formats:
+        parser.error('unknown %s format %r' % (command, fmt))
+
+    fluid = connect(options)
+    if command == 'export':
+        tags = options.tags and options.tags.split(',') or None
+        if fmt == 'columnar' and not tags:
+            parser.error('columnar exports need --tags')
+        outfile = open(path, 'wb')
+        try:
+            progress = export(fluid, query, WRITERS[fmt](outfile, tags),
+                              tags, options.workers,
+                              processes=options.processes)
+        finally:
+            outfile.close()
+        return progress.errors and 1 or 0
+
+    infile = open(path, 'rb')
+    try:
+        progress = load(fluid, READERS[fmt](infile, options.about),
+                        options.workers, Checkpoint(options.checkpoint))
+    finally:
+        infile.close()
+    return progress.errors and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+
+"""
+fom.codec
+=========
+
+JSON encoding and decoding shared by fom and the twitter client.
+
+The fastest available decoder is selected at import time, in the order given
+by :data:`PREFERRED_BACKENDS`. The choice can be forced with the
+``FOM_JSON_BACKEND`` environment variable or changed later with
+:func:`set_backend`.
+
+Strings always decode to unicode, whichever backend is selected. Response
+bodies are handed to the decoder as the raw byte strings read off the wire
+where it returns unicode for them; a backend that returns ``str`` for ASCII
+strings of a byte string document (simplejson does) is handed the body
+decoded from UTF-8 instead. The backends still differ in the errors they
+raise and in how they decode numbers, so they are not fully
+interchangeable.
+"""
+
+import os
+
+try:
+    import json as _std_json
+except ImportError:
+    import simplejson as _std_json
+
+
+#: Backend names, fastest first.
+PREFERRED_BACKENDS = ('ujson', 'yajl', 'simplejson', 'json')
+
+
+def _load_ujson():
+    import ujson
+    return ujson.loads
+
+
+def _load_yajl():
+    import yajl
+    return yajl.loads
+
+
+def _load_simplejson():
+    import simplejson
+    # Without the C speedups simplejson is slower than the stdlib module.
+    from simplejson import _speedups
+    return simplejson.loads
+
+
+def _load_json():
+    import json
+    return json.loads
+
+
+_LOADERS = {
+    'ujson': _load_ujson,
+    'yajl': _load_yajl,
+    'simplejson': _load_simplejson,
+    'json': _load_json,
+}
+
+
+def available_backends():
+    """Return the names of the decoders that can be imported here, fastest
+    first.
+    """
+    names = []
+    for name in PREFERRED_BACKENDS:
+        try:
+            _LOADERS[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def _decoding(loads):
+    def decoding_loads(data):
+        if isinstance(data, str):
+            data = data.decode('utf-8')
+        return loads(data)
+    return decoding_loads
+
+
+def get_loads(name):
+    """Return the ``loads`` function of the named backend, wrapped to decode
+    byte strings first if the backend does not return unicode for them.
+
+    :raises ImportError: if the backend is not installed.
+    :raises ValueError: if the name is unknown.
+    """
+    try:
+        loader = _LOADERS[name]
+    except KeyError:
+        raise ValueError('Unknown JSON backend %r.' % (name,))
+    loads = loader()
+    if not isinstance(loads('["a"]')[0], unicode):
+        loads = _decoding(loads)
+    return loads
+
+
+def set_backend(name):
+    """Select the decoder used by :func:`loads`.
+    """
+    global backend, _loads
+    _loads = get_loads(name)
+    backend = name
+
+
+def _select_backend():
+    forced = os.environ.get('FOM_JSON_BACKEND')
+    if forced:
+        set_backend(forced)
+        return
+    for name in PREFERRED_BACKENDS:
+        try:
+            set_backend(name)
+        except ImportError:
+            continue
+        return
+    set_backend('json')
+
+
+#: Name of the selected decoder.
+backend = None
+_loads = None
+_select_backend()
+
+
+def loads(data):
+    """Decode a JSON document.
+
+    :param data: The document, as a byte string or unicode.
+    """
+    return _loads(data)
+
+
+#: JSON for the scalars whose encoding is their str(), or a constant. The
+#: standard library encoder builds a new C encoder for each of these, which
+#: costs more than a small tag write's own request building.
+_SCALARS = {
+    int: str,
+    long: str,
+    bool: lambda value: value and 'true' or 'false',
+    type(None): lambda value: 'null',
+}
+
+
+def dumps(obj, sort_keys=False):
+    """Encode an object as JSON.
+
+    The standard library encoder is always used, to keep the output
+    identical whichever decoder is selected; ints, bools and None are
+    encoded directly, with the same result.
+    """
+    scalar = _SCALARS.get(type(obj))
+    if scalar is not None:
+        return scalar(obj)
+    return _std_json.dumps(obj, sort_keys=sort_keys)
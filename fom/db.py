@@ -6,19 +6,33 @@ fluiddb.db
 Raw connection and querying.
 """
 
+import Queue
+import collections
+import httplib
+import os
+import socket
+import sys
+import time
 import urllib
+import urlparse
 import httplib2
+import threading
 import types
+import zlib
 
-try:
-    import json
-except ImportError:
-    import simplejson as json
-
+from fom import codec
+from fom.breaker import FAILURES, get_breaker
+from fom.retry import LatencyTracker
+from fom import resolver
+from fom.resolver import ResolvingConnectionMixin, wrap_ssl
 from api import FluidApi
 
 BASE_URL = 'http://fluiddb.fluidinfo.com'
 PRIMITIVE_CONTENT_TYPE = 'application/vnd.fluiddb.value+json'
+#: Bytes moved per read or write by the streaming tag value methods.
+CHUNK_SIZE = 64 * 1024
+#: The response encodings asked for, all of which fom can decompress.
+ACCEPT_ENCODING = 'gzip, deflate'
 
 
 def _generate_endpoint_url(base, path, urlargs):
@@ -28,6 +42,15 @@ def _generate_endpoint_url(base, path, urlargs):
     return url
 
 
+def _quote_path(path):
+    """Quote a path for a request line written by fom itself, as httplib2
+    does for the requests it sends.
+    """
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return urllib.quote(path, safe='/')
+
+
 def _get_body_and_type(payload, content_type):
     if content_type:
         return payload, content_type
@@ -38,22 +61,362 @@ def _get_body_and_type(payload, content_type):
         if pt in (list, tuple):
             if not all([isinstance(x, basestring) for x in payload]):
                 raise ValueError('Non-string in list payload %r.' % (payload,))
-        return json.dumps(payload), PRIMITIVE_CONTENT_TYPE
+        return codec.dumps(payload), PRIMITIVE_CONTENT_TYPE
     
     raise ValueError("Can't handle payload %r of type %s" % (payload, pt))
 
 
+class _CountingResponse(httplib.HTTPResponse):
+    """Counts the body bytes read off the wire, before any decompression.
+
+    httplib2 replaces the length of a compressed body with that of the
+    decompressed one, so the count is handed on to it as the
+    ``-body-length`` pseudo header.
+    """
+
+    body_length = 0
+
+    def read(self, amt=None):
+        data = httplib.HTTPResponse.read(self, amt)
+        self.body_length += len(data)
+        return data
+
+    def getheaders(self):
+        return httplib.HTTPResponse.getheaders(self) + [
+            ('-body-length', str(self.body_length))]
+
+
+class HTTPConnection(ResolvingConnectionMixin,
+                     httplib2.HTTPConnectionWithTimeout):
+    """httplib2 HTTP connection resolving through fom.resolver.
+    """
+
+    response_class = _CountingResponse
+
+    def connect(self):
+        if getattr(self, 'proxy_info', None):
+            return httplib2.HTTPConnectionWithTimeout.connect(self)
+        self.sock = self._open_socket()
+
+
+class HTTPSConnection(ResolvingConnectionMixin,
+                      httplib2.HTTPSConnectionWithTimeout):
+    """httplib2 HTTPS connection resolving through fom.resolver.
+    """
+
+    response_class = _CountingResponse
+
+    def connect(self):
+        if getattr(self, 'proxy_info', None):
+            return httplib2.HTTPSConnectionWithTimeout.connect(self)
+        self.sock = wrap_ssl(self._open_socket(), self.host,
+            self.key_file, self.cert_file, getattr(self, 'ca_certs', None),
+            not getattr(self, 'disable_ssl_certificate_validation', False))
+
+
+CONNECTION_TYPES = {
+    'http': HTTPConnection,
+    'https': HTTPSConnection,
+}
+
+
+def _copy_into(response, buffer, chunk_size=CHUNK_SIZE):
+    """Read a response body into buffer through intermediate chunks.
+    """
+    offset = 0
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            return offset
+        if offset + len(chunk) > len(buffer):
+            raise ValueError('Tag value does not fit in a buffer of %d' %
+                             len(buffer))
+        buffer[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+
+
+def _decompressor(encoding, head):
+    """Return a zlib decompressor for a body in encoding starting with head.
+    """
+    if encoding != 'deflate':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    # "deflate" is meant to be zlib wrapped, but some servers send it raw.
+    if len(head) >= 2 and ord(head[0]) & 0x0f == 8 and \
+            (ord(head[0]) * 256 + ord(head[1])) % 31 == 0:
+        return zlib.decompressobj()
+    return zlib.decompressobj(-zlib.MAX_WBITS)
+
+
+def _content_encoding(response):
+    """Return the compression of an httplib response's body, or None.
+    """
+    encoding = (response.getheader('content-encoding') or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        return encoding
+    return None
+
+
+class _Inflater(object):
+    """Decompresses a response body as it is read, chunk by chunk.
+    """
+
+    def __init__(self, response, encoding):
+        self.response = response
+        self.encoding = encoding
+        self._decompressor = None
+        self._done = False
+
+    def read(self, amt=None):
+        try:
+            while not self._done:
+                data = self.response.read(amt)
+                if not data:
+                    self._done = True
+                    if self._decompressor is None:
+                        return ''
+                    return self._decompressor.flush()
+                if self._decompressor is None:
+                    self._decompressor = _decompressor(self.encoding, data)
+                data = self._decompressor.decompress(data)
+                if amt is None:
+                    self._done = True
+                    return data + self._decompressor.flush()
+                if data:
+                    return data
+            return ''
+        except zlib.error, e:
+            raise httplib.HTTPException(
+                'Content purported to be compressed with %s but failed to '
+                'decompress: %s' % (self.encoding, e))
+
+
+def _decoded(response):
+    """Return something to read response's body from, decompressed.
+    """
+    encoding = _content_encoding(response)
+    if encoding is None:
+        return response
+    return _Inflater(response, encoding)
+
+
+def _gzip(body):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+class _SharedFile(object):
+    """Stands in for a socket to ``httplib.HTTPResponse`` so consecutive
+    responses read from one buffered file, which they must not close.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def makefile(self, mode, bufsize=None):
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+    def close(self):
+        pass
+
+
+def _value_result(status, content, content_type):
+    """Return (status, value, value type) for a tag value response.
+    """
+    if status == 200:
+        if content_type == PRIMITIVE_CONTENT_TYPE:
+            return 200, codec.loads(content), None
+        return 200, content, content_type
+    return status, content, content_type
+
+
+def _source_length(source):
+    """Return the number of bytes left in an upload source.
+    """
+    if hasattr(source, 'fileno') and not hasattr(source, 'size'):
+        return os.fstat(source.fileno()).st_size - source.tell()
+    return len(source)
+
+
+class HttpPool(object):
+    """A thread safe pool of ``httplib2.Http`` instances.
+
+    Each instance keeps its connections open between requests, keyed by
+    scheme and host, so a pool shared by several :class:`FluidDB` instances
+    for the same host (over http and https, say) reuses the same sockets and
+    DNS answers.
+
+    :param size: The number of idle instances kept for reuse.
+    """
+
+    def __init__(self, size=8, timeout=None):
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take an instance out of the pool, creating one if none is idle.
+        """
+        self._lock.acquire()
+        try:
+            if self._idle:
+                return self._idle.pop()
+        finally:
+            self._lock.release()
+        return httplib2.Http(timeout=self.timeout)
+
+    def release(self, http):
+        """Give an instance back after a complete request.
+        """
+        self._lock.acquire()
+        try:
+            if len(self._idle) < self.size:
+                self._idle.append(http)
+                return
+        finally:
+            self._lock.release()
+        for connection in http.connections.values():
+            connection.close()
+
+    def request(self, *args):
+        """Make a request with a pooled instance, as ``httplib2.Http.request``.
+        """
+        http = self.acquire()
+        response, content = http.request(*args)
+        # Only reached when the request completed, so the connection is in a
+        # known state; on errors the instance is dropped with it.
+        self.release(http)
+        return response, content
+
+
+class TransferStats(object):
+    """Counts the bytes each request sent and received, both as they went
+    over the wire and as they were before compression or after
+    decompression, so the savings of compression can be seen.
+
+    .. attribute:: requests
+
+        The number of requests counted.
+
+    .. attribute:: sent, wire_sent
+
+        Request body bytes, uncompressed and as sent.
+
+    .. attribute:: received, wire_received
+
+        Response body bytes, decompressed and as received.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.requests = 0
+            self.sent = self.wire_sent = 0
+            self.received = self.wire_received = 0
+            self._recent = []
+            self._next = 0
+        finally:
+            self._lock.release()
+
+    def record(self, method, sent, wire_sent, received, wire_received):
+        """Count one request's bytes.
+        """
+        entry = (method, sent, wire_sent, received, wire_received)
+        self._lock.acquire()
+        try:
+            self.requests += 1
+            self.sent += sent
+            self.wire_sent += wire_sent
+            self.received += received
+            self.wire_received += wire_received
+            if len(self._recent) < self.size:
+                self._recent.append(entry)
+            else:
+                self._recent[self._next] = entry
+            self._next = (self._next + 1) % self.size
+        finally:
+            self._lock.release()
+
+    def recent(self):
+        """Return the counts of the latest requests, oldest first, as
+        (method, sent, wire sent, received, wire received) tuples.
+        """
+        self._lock.acquire()
+        try:
+            return self._recent[self._next:] + self._recent[:self._next]
+        finally:
+            self._lock.release()
+
+    def saved(self):
+        """Return the bytes compression kept off the wire, both ways.
+        """
+        return (self.sent - self.wire_sent) + \
+            (self.received - self.wire_received)
+
+
 class RestClient(object):
     """HTTP client.
 
     Could/Should be swapped out for other implementations. Although is
     generally synchronous.
+
+    .. attribute:: retry
+
+        A :class:`fom.retry.RetryPolicy` for idempotent requests, or None to
+        never retry.
+
+    .. attribute:: hedge
+
+        A :class:`fom.retry.HedgePolicy` for slow reads, or None to never
+        hedge.
+
+    .. attribute:: latencies
+
+        A :class:`fom.retry.LatencyTracker` of recent successful requests.
+
+    .. attribute:: pipeline
+
+        How many GETs :meth:`get_values` writes ahead on one connection
+        before reading their responses. 0 (the default) turns pipelining off
+        and gets each value with :meth:`get_value`.
+
+    .. attribute:: compress_threshold
+
+        Request bodies of at least this many bytes are sent gzip
+        compressed. None (the default) never compresses them. A server
+        answering 415 to a compressed body gets it again uncompressed, and
+        no more compressed bodies from this client.
+
+    .. attribute:: stats
+
+        A :class:`TransferStats` of the bytes moved by each request.
+
+    Responses are asked for compressed with gzip or deflate and
+    decompressed as they are read. Set the ``Accept-encoding`` entry of
+    :attr:`headers` to ``'identity'`` to have them sent uncompressed.
     """
 
     def __init__(self, db):
         self.base_url = db.base_url
+        self.pool = db.pool
+        self.retry = None
+        self.hedge = None
+        self.latencies = LatencyTracker()
+        self.pipeline = 0
+        self.compress_threshold = None
+        self._compress_refused = False
+        self.stats = TransferStats()
         self.headers = {
             'User-agent': 'fom',
+            'Accept-encoding': ACCEPT_ENCODING,
         }
 
     def __call__(self, method, path, payload=None, urlargs=None):
@@ -64,7 +427,7 @@ class RestClient(object):
         # print 'urlargs: %r' % (urlargs,)
         response, content = req(*params)
         if content:
-            content = json.loads(content)
+            content = codec.loads(content)
         else:
             content = None
         return response.status, content
@@ -74,7 +437,7 @@ class RestClient(object):
         if content_type is None:
             if isinstance(payload, dict):
                 content_type = 'application/json'
-                payload = json.dumps(payload)
+                payload = codec.dumps(payload)
             elif payload is None:
                 pass
             else:
@@ -89,8 +452,117 @@ class RestClient(object):
         urlargs = urlargs or {}
         headers = self._get_headers(content_type)
         url = self._get_url(path, urlargs)
-        http = httplib2.Http()
-        return http.request, (url, method, payload, headers)
+        connection_type = CONNECTION_TYPES.get(url.split(':', 1)[0])
+        return self.send, (url, method, payload, headers,
+                           httplib2.DEFAULT_MAX_REDIRECTS, connection_type)
+
+    def send(self, url, method, *params):
+        """Send a built request, retrying and hedging as configured, and
+        return the ``(response, content)`` pair from httplib2.
+        """
+        params = (url, method) + params
+        retry = self.retry
+        if retry is None or method not in retry.methods:
+            return self._send_once(params)
+        retry.budget.record_request()
+        attempt = 1
+        while True:
+            try:
+                response, content = self._send_once(params)
+            except FAILURES:
+                if attempt >= retry.attempts or not retry.budget.withdraw():
+                    raise
+            else:
+                if response.status not in retry.statuses or \
+                        attempt >= retry.attempts or \
+                        not retry.budget.withdraw():
+                    return response, content
+            time.sleep(retry.delay(attempt))
+            attempt += 1
+
+    def _send_once(self, params):
+        hedge = self.hedge
+        if hedge is not None and params[1] in hedge.methods:
+            delay = hedge.delay(self.latencies)
+            if delay is not None:
+                return self._send_hedged(params, delay, hedge.budget)
+        return self._send_timed(params)
+
+    def _send_timed(self, params):
+        body = params[2]
+        sent = wire_sent = body and len(body) or 0
+        compressed = self._compressed(params)
+        start = time.time()
+        if compressed is None:
+            response, content = self.pool.request(*params)
+        else:
+            response, content = self.pool.request(*compressed)
+            if response.status == 415:
+                # Unsupported Media Type: the server takes no compressed
+                # bodies.
+                self._compress_refused = True
+                response, content = self.pool.request(*params)
+            else:
+                wire_sent = len(compressed[2])
+        self.latencies.add(time.time() - start)
+        self.stats.record(params[1], sent, wire_sent, len(content),
+                          int(response.get('-body-length', len(content))))
+        return response, content
+
+    def _compressed(self, params):
+        """Return params with the body gzip compressed, or None if it should
+        be sent as it is.
+        """
+        threshold = self.compress_threshold
+        if threshold is None or self._compress_refused:
+            return None
+        url, method, body, headers = params[:4]
+        if method not in ('PUT', 'POST') or not isinstance(body, str) or \
+                len(body) < threshold or 'content-encoding' in headers:
+            return None
+        if isinstance(url, unicode):
+            # A unicode request line would make httplib decode the body.
+            url = url.encode('utf-8')
+        headers = headers.copy()
+        headers['content-encoding'] = 'gzip'
+        return (url, method, _gzip(body), headers) + params[4:]
+
+    def _send_hedged(self, params, delay, budget):
+        """Send params, and a copy of it if no answer came within delay.
+
+        Each copy runs in its own thread with its own pooled connection. The
+        first answer wins; a failure only counts if every copy failed.
+        """
+        budget.record_request()
+        results = Queue.Queue()
+
+        def attempt():
+            try:
+                results.put((True, self._send_timed(params)))
+            except:
+                results.put((False, sys.exc_info()))
+
+        def start():
+            thread = threading.Thread(target=attempt)
+            thread.setDaemon(True)
+            thread.start()
+
+        start()
+        pending = 1
+        try:
+            ok, result = results.get(timeout=delay)
+        except Queue.Empty:
+            if budget.withdraw():
+                start()
+                pending += 1
+            ok, result = results.get()
+        pending -= 1
+        while not ok and pending:
+            ok, result = results.get()
+            pending -= 1
+        if ok:
+            return result
+        raise result[0], result[1], result[2]
 
     def _get_headers(self, content_type):
         headers = self.headers.copy()
@@ -111,17 +583,218 @@ class RestClient(object):
     def get_value(self, path):
         req, params = self.build_request('GET', path, None, None, None)
         response, content = req(*params)
-        content_type = response['content-type']
-        if response.status == 200:
-            if response['content-type'] == PRIMITIVE_CONTENT_TYPE:
-                value = json.loads(content)
-                content_type = None
-            else:
-                value = content
-            return 200, value, content_type
+        return _value_result(response.status, content,
+                             response.get('content-type'))
+
+    def get_values(self, paths):
+        """Get the values of many tags, as :meth:`get_value` would.
+
+        With :attr:`pipeline` set the GETs are pipelined: up to that many
+        are written on one connection before the responses are read back in
+        order. If the server closes the connection, the requests it did not
+        answer are sent again on a new one; a server that answers none of
+        them, or cannot be connected to, gets the rest one at a time
+        instead.
+
+        :returns: A list of (status, value, value type), one per path.
+        """
+        if not self.pipeline:
+            return [self.get_value(path) for path in paths]
+        results = [None] * len(paths)
+        todo = collections.deque(enumerate(paths))
+        while todo:
+            answered = self._pipeline_once(todo, results)
+            if not answered:
+                while todo:
+                    i, path = todo.popleft()
+                    results[i] = self.get_value(path)
+        return results
+
+    def _pipeline_once(self, todo, results):
+        """Pipeline GETs from todo on one new connection, until they are
+        done or the connection closes. Unanswered requests are put back.
+
+        :returns: The number of responses read.
+        """
+        parsed = urlparse.urlparse(self.base_url)
+        headers = ''.join('%s: %s\r\n' % item for item
+                          in self._get_headers(None).iteritems())
+        prefix = 'GET ' + parsed.path
+        suffix = ' HTTP/1.1\r\nHost: %s\r\n%s\r\n' % (parsed.netloc, headers)
+        conn = self._new_connection()
+        pending = collections.deque()
+        answered = 0
+        try:
+            conn.connect()
+            reader = _SharedFile(conn.sock.makefile('rb'))
+            while todo or pending:
+                while todo and len(pending) < self.pipeline:
+                    i, path = todo.popleft()
+                    pending.append((i, path))
+                    conn.sock.sendall(prefix + _quote_path(path) + suffix)
+                response = _CountingResponse(reader, method='GET')
+                response.begin()
+                content = _decoded(response).read()
+                i, path = pending.popleft()
+                results[i] = _value_result(response.status, content,
+                    response.getheader('content-type'))
+                self.stats.record('GET', 0, 0, len(content),
+                                  response.body_length)
+                answered += 1
+                if response.will_close:
+                    break
+        except (socket.error, httplib.HTTPException):
+            # Refused or closed by the server; what it did not answer is
+            # sent again.
+            pass
+        finally:
+            conn.close()
+            todo.extendleft(reversed(pending))
+        return answered
+
+    def _new_connection(self):
+        """Return an unconnected connection of its own, outside the pool.
+        """
+        parsed = urlparse.urlparse(self.base_url)
+        if parsed.scheme == 'https':
+            conn_type = resolver.HTTPSConnection
         else:
-            return response.status, content, content_type
-            
+            conn_type = resolver.HTTPConnection
+        if self.pool.timeout is None:
+            conn = conn_type(parsed.netloc)
+        else:
+            conn = conn_type(parsed.netloc, timeout=self.pool.timeout)
+        conn.response_class = _CountingResponse
+        return conn
+
+    def _open_stream(self, method, path, headers):
+        """Start a request on a connection of its own, outside the pool,
+        and return the connection after the headers are sent.
+        """
+        parsed = urlparse.urlparse(self.base_url)
+        conn = self._new_connection()
+        conn.putrequest(method, parsed.path + _quote_path(path))
+        for name, value in headers.iteritems():
+            conn.putheader(name, value)
+        conn.endheaders()
+        return conn
+
+    def get_value_stream(self, path, fileobj, chunk_size=CHUNK_SIZE):
+        """Copy a tag value into fileobj without holding it in memory.
+
+        The body is written as it arrives, in chunk_size pieces,
+        decompressed on the way if the server compressed it; a primitive
+        value is written as its JSON text. Nothing is written unless the
+        status is 200.
+
+        :returns: (status, content type, bytes written)
+        """
+        conn = self._open_stream('GET', path, self._get_headers(None))
+        try:
+            response = conn.getresponse()
+            content_type = response.getheader('content-type')
+            written = 0
+            if response.status == 200:
+                body = _decoded(response)
+                while True:
+                    chunk = body.read(chunk_size)
+                    if not chunk:
+                        break
+                    fileobj.write(chunk)
+                    written += len(chunk)
+            self.stats.record('GET', 0, 0, written, response.body_length)
+            return response.status, content_type, written
+        finally:
+            conn.close()
+
+    def get_value_into(self, path, buffer):
+        """Read a tag value straight into a caller supplied writable buffer,
+        such as a bytearray.
+
+        When the buffer supports ``memoryview`` the body is received with
+        ``recv_into`` and never copied; otherwise (an mmap, for example), or
+        when the server compressed it, it is copied over chunk by chunk.
+
+        :returns: (status, content type, bytes read)
+        :raises ValueError: if the value does not fit in the buffer.
+        """
+        conn = self._open_stream('GET', path, self._get_headers(None))
+        try:
+            # Unbuffered, so the socket is left at the start of the body.
+            response = conn.getresponse()
+            content_type = response.getheader('content-type')
+            if response.status != 200:
+                return response.status, content_type, 0
+            length = response.length
+            if length is None or response.chunked or \
+                    _content_encoding(response) is not None:
+                # Size unknown up front, fall back to copying
+                return response.status, content_type, \
+                    self._copy_into(response, buffer)
+            if length > len(buffer):
+                raise ValueError('Tag value of %d bytes does not fit in a '
+                                 'buffer of %d' % (length, len(buffer)))
+            try:
+                view = memoryview(buffer)
+            except TypeError:
+                return response.status, content_type, \
+                    self._copy_into(response, buffer)
+            received = 0
+            while received < length:
+                n = conn.sock.recv_into(view[received:length],
+                                        length - received)
+                if not n:
+                    raise httplib.IncompleteRead(view[:received].tobytes(),
+                                                 length - received)
+                received += n
+            self.stats.record('GET', 0, 0, received, received)
+            return response.status, content_type, received
+        finally:
+            conn.close()
+
+    def _copy_into(self, response, buffer):
+        copied = _copy_into(_decoded(response), buffer)
+        self.stats.record('GET', 0, 0, copied, response.body_length)
+        return copied
+
+    def put_value_stream(self, path, source, value_type, length=None,
+                         chunk_size=CHUNK_SIZE):
+        """Upload a tag value from source without holding it in memory.
+
+        :param source: A file-like object, read from its current position in
+            chunk_size pieces, or an object supporting the buffer interface,
+            like an ``mmap``, which is sent in slices without copying.
+        :param value_type: The MIME type of the value.
+        :param length: The number of bytes to send. Worked out from the
+            length of a buffer or the size of a real file when omitted.
+        :returns: The status code.
+        """
+        if length is None:
+            length = _source_length(source)
+        headers = self._get_headers(value_type)
+        headers['content-length'] = str(length)
+        conn = self._open_stream('PUT', path, headers)
+        try:
+            if hasattr(source, 'read') and not hasattr(source, 'size'):
+                remaining = length
+                while remaining:
+                    chunk = source.read(min(chunk_size, remaining))
+                    if not chunk:
+                        raise ValueError('Source ended %d bytes short' %
+                                         remaining)
+                    conn.send(chunk)
+                    remaining -= len(chunk)
+            else:
+                for offset in xrange(0, length, chunk_size):
+                    conn.send(buffer(source, offset,
+                                     min(chunk_size, length - offset)))
+            response = conn.getresponse()
+            content = response.read()
+            self.stats.record('PUT', length, length, len(content),
+                              len(content))
+            return response.status
+        finally:
+            conn.close()
 
     def login(self, username, password):
         userpass = username + ':' + password
@@ -131,27 +804,231 @@ class RestClient(object):
     def logout(self):
         del self.headers['Authorization']
 
+    def prepare(self, method, path_template, content_type=None,
+                urlargs=None):
+        """Return a :class:`PreparedRequest` for method on path_template.
+        """
+        return PreparedRequest(self, method, path_template, content_type,
+                               urlargs)
+
+
+class PreparedRequest(object):
+    """A request with its URL, headers and connection type worked out up
+    front, for sending many times over in a loop.
+
+    Only the path arguments and the body change from call to call:
+
+    >>> put = fluid.db.prepare('PUT', '/objects/%s/test/rating',
+    ...                        PRIMITIVE_CONTENT_TYPE)
+    >>> put((uid,), 5)
+    (204, None)
+
+    :param path_template: The path, with ``%`` formatting placeholders for
+        the arguments.
+    :param content_type: The type of the body. Bodies of the primitive
+        value and JSON types are encoded as JSON; other bodies are sent as
+        they are. None for requests without a body.
+    :param urlargs: Query string arguments, the same for every call.
+    :param breaker: An optional :class:`fom.breaker.CircuitBreaker` to
+        send through.
+    """
+
+    def __init__(self, client, method, path_template, content_type=None,
+                 urlargs=None, breaker=None):
+        self.client = client
+        self.method = method
+        self.content_type = content_type
+        self.encode = content_type in (PRIMITIVE_CONTENT_TYPE,
+                                       'application/json')
+        self.breaker = breaker
+        self.url_template = client.base_url.replace('%', '%%') + path_template
+        if urlargs:
+            self.url_template = '?'.join([
+                self.url_template,
+                urllib.urlencode(urlargs).replace('%', '%%')])
+        self.connection_type = CONNECTION_TYPES.get(
+            self.url_template.split(':', 1)[0])
+        self._prepare_headers()
+
+    def _prepare_headers(self):
+        self._client_headers = self.client.headers.copy()
+        self.headers = self.client._get_headers(self.content_type)
+
+    def build(self, args=(), payload=None):
+        """Return the parameters for :meth:`RestClient.send`.
+        """
+        if self.client.headers != self._client_headers:
+            # Logged in or out since the request was prepared.
+            self._prepare_headers()
+        if self.encode:
+            payload = codec.dumps(payload)
+        return (self.url_template % args, self.method, payload, self.headers,
+                httplib2.DEFAULT_MAX_REDIRECTS, self.connection_type)
+
+    def send(self, args=(), payload=None):
+        response, content = self.client.send(*self.build(args, payload))
+        content_type = response.get('content-type')
+        if content and content_type in (PRIMITIVE_CONTENT_TYPE,
+                                        'application/json'):
+            content = codec.loads(content)
+        elif not content:
+            content = None
+        return response.status, content
+
+    def __call__(self, args=(), payload=None):
+        """Send the request and return ``(status, content)``, with JSON and
+        primitive value bodies decoded.
+        """
+        if self.breaker is None:
+            return self.send(args, payload)
+        return self.breaker.call(self.send, args, payload)
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Runs concurrent calls with the same key once.
+
+    The first caller for a key runs the call; callers arriving while it is in
+    flight wait and get the same result, or the same exception. Shared
+    results are the same objects, so callers must not mutate them.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kw):
+        self._lock.acquire()
+        try:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        finally:
+            self._lock.release()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error[0], flight.error[1], flight.error[2]
+            return flight.result
+
+        try:
+            try:
+                flight.result = func(*args, **kw)
+            except:
+                flight.error = sys.exc_info()
+                raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._flights[key]
+            finally:
+                self._lock.release()
+            flight.done.set()
+        return flight.result
+
 
 class FluidDB(object):
     """A fluiddb connector.
+
+    :param pool: The :class:`HttpPool` to make requests with. Connectors for
+        the same host may share one.
+
+    .. attribute:: breaker
+
+        The :class:`fom.breaker.CircuitBreaker` for this host, shared with
+        every other connector to it.
+
+    .. attribute:: coalesce
+
+        When true (the default), identical GETs made at the same time from
+        several threads share a single request and its result.
+
+    .. attribute:: replica
+
+        An optional :class:`fom.replica.Replica` that
+        :class:`fom.mapping.Object` reads tag values from instead of making
+        requests. None (the default) disables it.
     """
 
-    def __init__(self, base_url=BASE_URL):
+    def __init__(self, base_url=BASE_URL, pool=None):
         self.base_url = base_url
+        if pool is None:
+            pool = HttpPool()
+        self.pool = pool
+        self.breaker = get_breaker(base_url)
+        self.coalesce = True
+        self.flights = SingleFlight()
+        self.replica = None
         self.client = RestClient(self)
 
     def __call__(self, method, path, payload=None, urlargs=None, **kw):
         """Perform a call on the fluiddb.
         """
-        return self.client.__call__(method, path, payload, urlargs, **kw)
+        if self.coalesce and method == 'GET' and not kw:
+            key = ('GET', path, tuple(sorted((urlargs or {}).items())))
+            try:
+                hash(key)
+            except TypeError:
+                pass
+            else:
+                return self.flights.do(key, self.breaker.call,
+                    self.client.__call__, method, path, payload, urlargs)
+        return self.breaker.call(self.client.__call__,
+                                 method, path, payload, urlargs, **kw)
 
     def put_value(self, path, value, value_type=None):
         """Set a tag value in fluiddb.
         """
-        return self.client.put_value(path, value, value_type)
+        return self.breaker.call(self.client.put_value,
+                                 path, value, value_type)
 
     def get_value(self, path):
         """Get a tag's value and type from fluiddb.
         """
-        return self.client.get_value(path)
+        if self.coalesce:
+            return self.flights.do(('value', path), self.breaker.call,
+                                   self.client.get_value, path)
+        return self.breaker.call(self.client.get_value, path)
+
+    def get_values(self, paths):
+        """Get many tags' values and types, pipelined if the client is set
+        to. Any 5xx among them counts as a failure of the host.
+        """
+        def get_values():
+            values = self.client.get_values(paths)
+            return max([value[0] for value in values] or [200]), values
+        return self.breaker.call(get_values)[1]
+
+    def get_value_stream(self, path, fileobj, chunk_size=CHUNK_SIZE):
+        """Copy a tag value into a file-like object in chunks.
+        """
+        return self.breaker.call(self.client.get_value_stream,
+                                 path, fileobj, chunk_size)
+
+    def get_value_into(self, path, buffer):
+        """Read a tag value into a writable buffer.
+        """
+        return self.breaker.call(self.client.get_value_into, path, buffer)
+
+    def put_value_stream(self, path, source, value_type, length=None):
+        """Upload a tag value from a file-like object or buffer.
+        """
+        return self.breaker.call(self.client.put_value_stream,
+                                 path, source, value_type, length)
+
+    def prepare(self, method, path_template, content_type=None,
+                urlargs=None):
+        """Return a :class:`PreparedRequest` sent through the breaker.
+        """
+        return PreparedRequest(self.client, method, path_template,
+                               content_type, urlargs, self.breaker)
 
@@ -0,0 +1,168 @@
+
+"""
+fom.index
+=========
+
+In-memory secondary indexes over the values of a tag.
+
+A :class:`TagIndex` answers the comparisons of the query language for one tag
+without scanning its values:
+
+>>> index = TagIndex([(uid1, 3), (uid2, u'three'), (uid3, [u'a', u'b'])])
+>>> index.compare('=', u'three')
+set([uid2])
+>>> index.compare('>', 2)
+set([uid1])
+>>> index.contains(u'a')
+set([uid3])
+
+Equality and set membership use a :class:`HashIndex`, and ranges over
+numeric values use a :class:`SortedIndex`.
+"""
+
+import bisect
+
+
+def is_number(value):
+    """Return True for ints, longs and floats, but not for bools.
+    """
+    return isinstance(value, (int, long, float)) and \
+        not isinstance(value, bool)
+
+
+def _key(value):
+    # Keep True apart from 1 and 1.0, which hash and compare the same.
+    if isinstance(value, bool):
+        return ('bool', value)
+    if is_number(value):
+        return ('number', value)
+    return ('value', value)
+
+
+class HashIndex(object):
+    """Maps values to the set of ids of the objects that have them.
+
+    Unhashable values are ignored.
+    """
+
+    def __init__(self):
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, uid, value):
+        try:
+            self._ids.setdefault(_key(value), set()).add(uid)
+        except TypeError:
+            pass
+
+    def remove(self, uid, value):
+        try:
+            key = _key(value)
+            ids = self._ids.get(key)
+        except TypeError:
+            return
+        if ids is not None:
+            ids.discard(uid)
+            if not ids:
+                del self._ids[key]
+
+    def lookup(self, value):
+        """Return the set of ids with value.
+        """
+        try:
+            return set(self._ids.get(_key(value), ()))
+        except TypeError:
+            return set()
+
+
+class SortedIndex(object):
+    """Keeps values and ids in two parallel lists, sorted by (value, id), for
+    range scans by bisection.
+    """
+
+    def __init__(self, pairs=()):
+        entries = sorted((value, uid) for uid, value in pairs)
+        self._values = [value for value, uid in entries]
+        self._ids = [uid for value, uid in entries]
+
+    def __len__(self):
+        return len(self._values)
+
+    def _find(self, uid, value):
+        position = bisect.bisect_left(self._values, value)
+        end = bisect.bisect_right(self._values, value)
+        return position + bisect.bisect_left(self._ids[position:end], uid)
+
+    def add(self, uid, value):
+        position = self._find(uid, value)
+        self._values.insert(position, value)
+        self._ids.insert(position, uid)
+
+    def remove(self, uid, value):
+        position = self._find(uid, value)
+        if position < len(self._ids) and self._ids[position] == uid and \
+                self._values[position] == value:
+            del self._values[position]
+            del self._ids[position]
+
+    def range(self, low=None, high=None, include_low=True,
+              include_high=True):
+        """Return the set of ids with values between low and high. None
+        leaves that end open.
+        """
+        start, end = 0, len(self._values)
+        if low is not None:
+            if include_low:
+                start = bisect.bisect_left(self._values, low)
+            else:
+                start = bisect.bisect_right(self._values, low)
+        if high is not None:
+            if include_high:
+                end = bisect.bisect_right(self._values, high)
+            else:
+                end = bisect.bisect_left(self._values, high)
+        return set(self._ids[start:end])
+
+
+class TagIndex(object):
+    """The indexes over the values of one tag.
+
+    :param pairs: (object id, value) pairs.
+    """
+
+    def __init__(self, pairs=()):
+        pairs = list(pairs)
+        self.values = HashIndex()
+        self.members = HashIndex()
+        for uid, value in pairs:
+            self.values.add(uid, value)
+            if isinstance(value, list):
+                for member in value:
+                    self.members.add(uid, member)
+        self.numbers = SortedIndex((uid, value) for uid, value in pairs
+                                   if is_number(value))
+
+    def compare(self, op, value):
+        """Return the set of ids whose value compares to value with op,
+        one of ``=``, ``<``, ``>``, ``<=`` or ``>=``.
+        """
+        if op == '=':
+            return self.values.lookup(value)
+        if not is_number(value):
+            return set()
+        if op == '<':
+            return self.numbers.range(high=value, include_high=False)
+        if op == '<=':
+            return self.numbers.range(high=value)
+        if op == '>':
+            return self.numbers.range(low=value, include_low=False)
+        if op == '>=':
+            return self.numbers.range(low=value)
+        raise ValueError('Unknown operator %r' % op)
+
+    def contains(self, value):
+        """Return the set of ids whose set value contains value.
+        """
+        return self.members.lookup(value)
@@ -9,7 +9,7 @@ Object orientated interface into FluidDB
 """
 
 
-from fom.session import Fluid
+from fom.session import current_fluid
 
 
 
@@ -37,15 +37,31 @@ class SessionBound(object):
 
     .. attribute:: fluid
 
-        The instance of fom.session.Fluid bound to this item.
+        The instance of fom.session.Fluid bound to this item. Defaults to the
+        session bound to the current thread, see
+        :func:`fom.session.current_fluid`.
     """
 
+    _api = None
+
     def __init__(self, path, fluid=None):
         self.path = path
         if fluid is None:
-            fluid = Fluid.bound
+            fluid = current_fluid()
         self.fluid = fluid
 
+    def _component(self, container):
+        """Return the api component for this item from the named container
+        of the session, keeping it for later calls as long as the path and
+        session stay the same.
+        """
+        api = self._api
+        if api is None or self._api_key[0] is not self.fluid or \
+                self._api_key[1] is not self.path:
+            api = self._api = getattr(self.fluid, container)[self.path]
+            self._api_key = (self.fluid, self.path)
+        return api
+
 
 class Namespace(SessionBound):
     """A Namespace
@@ -53,7 +69,7 @@ class Namespace(SessionBound):
 
     @property
     def api(self):
-        return self.fluid.namespaces[self.path]
+        return self._component('namespaces')
 
     def delete(self):
         """Delete this namespace
@@ -77,7 +93,7 @@ class Namespace(SessionBound):
         """
         status, response = self.api.post(name, description)
         if status == 201:
-            return Namespace(path_child(self.path, name))
+            return Namespace(path_child(self.path, name), self.fluid)
         else:
             # print response
             pass
@@ -119,7 +135,7 @@ class Namespace(SessionBound):
     @property
     def tags(self):
         return [
-            Tag(path) for path in self.tag_paths
+            Tag(path, self.fluid) for path in self.tag_paths
         ]
 
     @property
@@ -142,18 +158,18 @@ class Namespace(SessionBound):
         """Return the child namespaces.
         """
         return [
-            Namespace(path) for path in self.namespace_paths
+            Namespace(path, self.fluid) for path in self.namespace_paths
         ]
 
     def tag(self, name):
         """Get a child tag.
         """
-        return Tag(path_child(self.path, name))
+        return Tag(path_child(self.path, name), self.fluid)
 
     def namespace(self, name):
         """Get a child namespace.
         """
-        return Namespace(path_child(self.path, name))
+        return Namespace(path_child(self.path, name), self.fluid)
 
 
 class Tag(SessionBound):
@@ -164,7 +180,7 @@ class Tag(SessionBound):
     def api(self):
         """The api TagApi for this instance.
         """
-        return self.fluid.tags[self.path]
+        return self._component('tags')
 
     def _get_description(self):
         """Get the description for a tag.
@@ -201,12 +217,21 @@ class Object(SessionBound):
     def api(self):
         """The api ObjectApi for this instance.
         """
-        return self.fluid.objects[self.path]
+        return self._component('objects')
+
+    @property
+    def replica(self):
+        """The :class:`fom.replica.Replica` of the session, or None.
+        """
+        return getattr(self.fluid.db, 'replica', None)
 
     def get(self, tag):
         """Get the value of a tag.
         """
         tagpath = tag
+        replica = self.replica
+        if replica is not None:
+            return replica.get(self.uid, tagpath)
         status, value, value_type = self.api[tagpath].get()
         if status == 200:
             return value, value_type
@@ -219,22 +244,31 @@ class Object(SessionBound):
         tagpath = tag
         status = self.api[tagpath].put(value, valueType)
         assert status == 204
+        replica = self.replica
+        if replica is not None:
+            replica.store(self.uid, tagpath, value, valueType)
 
     def has(self, tag):
         """Check if an object has a tag.
         """
         tagpath = tag
+        replica = self.replica
+        if replica is not None:
+            return replica.has(self.uid, tagpath)
         status, response = self.api[tagpath].head()
         return status == 200
 
     @property
     def tag_paths(self):
+        replica = self.replica
+        if replica is not None:
+            return replica.tag_paths(self.uid)
         status, response = self.api.get()
         return response[u'tagPaths']
 
     @property
     def tags(self):
-        return [Tag(path) for path in self.tag_paths]
+        return [Tag(path, self.fluid) for path in self.tag_paths]
 
 
 
@@ -267,7 +301,7 @@ class tag_relation(tag_value):
         uid, content_type = tag_value.__get__(self, instance, owner)
         # Must be a primitive type?  (I.e., uid is a string)
         assert content_type is None
-        return self.object_type(uid)
+        return self.object_type(uid, instance.fluid)
 
     def __set__(self, instance, value):
         return tag_value.__set__(self, instance, value.uid)
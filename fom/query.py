@@ -0,0 +1,369 @@
+
+"""
+fom.query
+=========
+
+A parser and evaluator for the FluidDB query language.
+
+Queries are parsed into a tree of nodes:
+
+>>> parse('has test/rating and test/rating > 3 except has test/hidden')
+And(Has('test/rating'), Except(Compare('test/rating', '>', 3), Has('test/hidden')))
+
+and evaluated by :class:`Evaluator` against a local source of tag values,
+such as a :class:`fom.replica.Replica`. Parts of a query over tags the source
+does not hold are sent to FluidDB as smaller queries and their results
+combined with the local ones.
+
+Operator precedence follows FluidDB: ``except`` binds tighter than ``and``,
+which binds tighter than ``or``.
+"""
+
+import re
+
+from fom import codec
+from fom.index import is_number
+
+
+class QueryError(ValueError):
+    """Raised for a query that cannot be parsed.
+    """
+
+
+class RemoteQueryError(QueryError):
+    """Raised when FluidDB does not answer 200 to (part of) a query.
+
+    .. attribute:: status
+    .. attribute:: response
+
+        FluidDB's status code and decoded response.
+    """
+
+    def __init__(self, status, response, query):
+        QueryError.__init__(self, 'FluidDB answered %s to %r' %
+                            (status, query))
+        self.status = status
+        self.response = response
+
+
+_TOKEN = re.compile(r'''\s*(?:
+    (?P<string>"(?:[^"\\]|\\.)*") |
+    (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![^\s()=<>"])) |
+    (?P<op><=|>=|=|<|>|\(|\)) |
+    (?P<word>[^\s()=<>"]+)
+)''', re.X)
+
+KEYWORDS = ('has', 'contains', 'and', 'or', 'except')
+COMPARISONS = ('=', '<', '>', '<=', '>=')
+
+
+def tokenize(query):
+    """Split a query into (kind, text) tokens.
+    """
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if match is None or match.end() == position:
+            raise QueryError('Unexpected %r at %d' % (query[position:],
+                                                      position))
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'word' and text.lower() in KEYWORDS:
+            kind, text = 'keyword', text.lower()
+        tokens.append((kind, text))
+        position = match.end()
+    return tokens
+
+
+def _literal(kind, text):
+    if kind == 'string':
+        try:
+            return codec.loads(text)
+        except ValueError:
+            raise QueryError('Bad string %s' % text)
+    if kind == 'number':
+        if '.' in text or 'e' in text.lower():
+            return float(text)
+        return int(text)
+    raise QueryError('Expected a value, got %r' % text)
+
+
+def _quote(value):
+    if isinstance(value, basestring):
+        return codec.dumps(value)
+    return repr(value)
+
+
+class Node(object):
+    """A node in a parsed query.
+    """
+
+    def tags(self):
+        """Return the set of tag paths the node depends on.
+        """
+        raise NotImplementedError
+
+    def local(self, source):
+        """Return the set of matching object ids, using only source.
+        """
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        return type(self) is type(other) and vars(self) == vars(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class Has(Node):
+
+    def __init__(self, tag):
+        self.tag = tag
+
+    def tags(self):
+        return set([self.tag])
+
+    def local(self, source):
+        return source.ids_with(self.tag)
+
+    def __unicode__(self):
+        return u'has %s' % self.tag
+
+    def __repr__(self):
+        return 'Has(%r)' % self.tag
+
+
+def _compare(op, value, literal):
+    if op == '=':
+        if is_number(literal):
+            return is_number(value) and value == literal
+        return not is_number(value) and value == literal
+    if not (is_number(value) and is_number(literal)):
+        return False
+    if op == '<':
+        return value < literal
+    if op == '>':
+        return value > literal
+    if op == '<=':
+        return value <= literal
+    return value >= literal
+
+
+class Compare(Node):
+
+    def __init__(self, tag, op, value):
+        self.tag = tag
+        self.op = op
+        self.value = value
+
+    def tags(self):
+        return set([self.tag])
+
+    def local(self, source):
+        if hasattr(source, 'compare'):
+            return source.compare(self.tag, self.op, self.value)
+        return set(uid for uid, value in source.values(self.tag)
+                   if _compare(self.op, value, self.value))
+
+    def __unicode__(self):
+        return u'%s %s %s' % (self.tag, self.op, _quote(self.value))
+
+    def __repr__(self):
+        return 'Compare(%r, %r, %r)' % (self.tag, self.op, self.value)
+
+
+class Contains(Node):
+
+    def __init__(self, tag, value):
+        self.tag = tag
+        self.value = value
+
+    def tags(self):
+        return set([self.tag])
+
+    def local(self, source):
+        if hasattr(source, 'contains'):
+            return source.contains(self.tag, self.value)
+        return set(uid for uid, value in source.values(self.tag)
+                   if isinstance(value, list) and self.value in value)
+
+    def __unicode__(self):
+        return u'%s contains %s' % (self.tag, _quote(self.value))
+
+    def __repr__(self):
+        return 'Contains(%r, %r)' % (self.tag, self.value)
+
+
+class BinaryNode(Node):
+    """Combines the results of two nodes.
+    """
+
+    keyword = None
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def tags(self):
+        return self.left.tags() | self.right.tags()
+
+    def local(self, source):
+        return self.combine(self.left.local(source),
+                            self.right.local(source))
+
+    def __unicode__(self):
+        return u'(%s) %s (%s)' % (unicode(self.left), self.keyword,
+                                  unicode(self.right))
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (type(self).__name__, self.left, self.right)
+
+
+class And(BinaryNode):
+    keyword = 'and'
+
+    def combine(self, left, right):
+        return left & right
+
+
+class Or(BinaryNode):
+    keyword = 'or'
+
+    def combine(self, left, right):
+        return left | right
+
+
+class Except(BinaryNode):
+    keyword = 'except'
+
+    def combine(self, left, right):
+        return left - right
+
+
+class _Parser(object):
+
+    def __init__(self, query):
+        self.tokens = tokenize(query)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise QueryError('Unexpected end of query')
+        self.position += 1
+        return token
+
+    def accept(self, kind, text):
+        if self.peek() == (kind, text):
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek()[0] is not None:
+            raise QueryError('Unexpected %r' % self.peek()[1])
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.accept('keyword', 'or'):
+            node = Or(node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_except()
+        while self.accept('keyword', 'and'):
+            node = And(node, self.parse_except())
+        return node
+
+    def parse_except(self):
+        node = self.parse_atom()
+        while self.accept('keyword', 'except'):
+            node = Except(node, self.parse_atom())
+        return node
+
+    def parse_atom(self):
+        if self.accept('op', '('):
+            node = self.parse_or()
+            if not self.accept('op', ')'):
+                raise QueryError('Missing )')
+            return node
+        if self.accept('keyword', 'has'):
+            kind, tag = self.next()
+            if kind != 'word':
+                raise QueryError('Expected a tag after has, got %r' % tag)
+            return Has(tag)
+        kind, tag = self.next()
+        if kind != 'word':
+            raise QueryError('Expected a tag, got %r' % tag)
+        kind, op = self.next()
+        if kind == 'keyword' and op == 'contains':
+            return Contains(tag, _literal(*self.next()))
+        if kind == 'op' and op in COMPARISONS:
+            return Compare(tag, op, _literal(*self.next()))
+        raise QueryError('Expected an operator after %s, got %r' % (tag, op))
+
+
+_parsed = {}
+#: Parsed queries kept for re-use.
+PARSE_CACHE_SIZE = 1000
+
+
+def parse(query):
+    """Parse a query into a :class:`Node`, raising :class:`QueryError`.
+    """
+    node = _parsed.get(query)
+    if node is None:
+        node = _Parser(query).parse()
+        if len(_parsed) >= PARSE_CACHE_SIZE:
+            _parsed.clear()
+        _parsed[query] = node
+    return node
+
+
+class Evaluator(object):
+    """Evaluates queries locally where it can.
+
+    :param source: Provides ``holds(tag)``, whether every value of a tag is
+        available locally, ``ids_with(tag)``, the set of ids of objects with
+        it, and ``values(tag)``, an iterable of (object id, value) pairs for
+        its primitive values. Sources that also provide
+        ``compare(tag, op, value)`` and ``contains(tag, value)``, answering
+        from an index, are used through those instead of scanning values.
+    :param remote: Called with a query string to run on FluidDB; returns
+        the matching object ids.
+    """
+
+    def __init__(self, source, remote):
+        self.source = source
+        self.remote = remote
+
+    def holds(self, node):
+        for tag in node.tags():
+            if not self.source.holds(tag):
+                return False
+        return True
+
+    def evaluate(self, node):
+        """Return the set of ids of objects matching node.
+        """
+        if self.holds(node):
+            return node.local(self.source)
+        if isinstance(node, BinaryNode) and \
+                [tag for tag in node.tags() if self.source.holds(tag)]:
+            return node.combine(self.evaluate(node.left),
+                                self.evaluate(node.right))
+        return set(self.remote(unicode(node)))
+
+    def query(self, query):
+        """Return the list of ids of objects matching a query string.
+        """
+        return list(self.evaluate(parse(query)))
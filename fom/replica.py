@@ -0,0 +1,432 @@
+
+"""
+fom.replica
+===========
+
+A local, indexed replica of the objects and tag values under chosen
+namespaces, kept in sqlite.
+
+The replica is filled through the query and tag APIs by :meth:`Replica.sync`,
+which can be called again to bring it up to date: objects that gained a tag
+are fetched, objects that lost it are dropped and values older than
+``max_age`` seconds are fetched again.
+
+Once attached to a session, :class:`fom.mapping.Object` serves ``get``,
+``has`` and ``tag_paths`` from it, reading through to FluidDB for whatever it
+does not hold. :meth:`fom.api.ObjectsApi.get` answers queries from it too,
+sending FluidDB only the parts of a query over tags it does not hold:
+
+>>> replica = Replica('cache.db', fluid, ['test/books'])
+>>> replica.sync()
+>>> fluid.db.replica = replica
+>>> Object(uid).get('test/books/title')   # no request made
+
+Writes made through :meth:`fom.mapping.Object.set` are written through to the
+replica as well.
+
+Reverse lookups such as "which objects have test/books/year > 1990" use the
+``(tag, number)`` index on disk for numeric ranges, and a
+:class:`fom.index.TagIndex` built in memory the first time a tag is looked up
+by value otherwise. It is dropped whenever a value of the tag changes.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+from fom import codec
+from fom.index import TagIndex, is_number
+from fom.mapping import Namespace
+from fom.query import Evaluator, QueryError, RemoteQueryError
+
+log = logging.getLogger('fom.replica')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tag_values (
+    object_id TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    value BLOB,
+    value_type TEXT,
+    fetched REAL NOT NULL,
+    number REAL,
+    PRIMARY KEY (object_id, tag)
+);
+CREATE INDEX IF NOT EXISTS tag_values_by_tag ON tag_values (tag);
+CREATE INDEX IF NOT EXISTS tag_values_by_number ON tag_values (tag, number);
+CREATE TABLE IF NOT EXISTS objects (
+    object_id TEXT PRIMARY KEY,
+    tag_paths TEXT NOT NULL,
+    fetched REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS synced_tags (
+    tag TEXT PRIMARY KEY,
+    synced REAL NOT NULL
+);
+"""
+
+#: SQL for the range comparisons of the query language.
+RANGES = {'<': '<', '>': '>', '<=': '<=', '>=': '>='}
+
+#: Marks a tag that the replica knows an object does not have.
+MISSING = object()
+
+#: Writes :meth:`Replica.sync` makes between commits.
+COMMIT_EVERY = 1000
+
+
+def _encode(value, value_type):
+    if value_type is None:
+        return codec.dumps(value)
+    return buffer(value)
+
+
+def _decode(value, value_type):
+    if value_type is None:
+        return codec.loads(value)
+    return str(value)
+
+
+class Replica(object):
+    """A sqlite replica of the tags under some namespaces.
+
+    :param path: The sqlite database file, or ``':memory:'``.
+    :param fluid: The session used to fill the replica and read through.
+    :param namespaces: The namespace paths whose tags are replicated.
+    :param max_age: Seconds after which a value is fetched again by
+        :meth:`sync`, and after which a cached tag list is not trusted.
+    """
+
+    def __init__(self, path, fluid, namespaces, max_age=3600):
+        self.fluid = fluid
+        self.namespaces = list(namespaces)
+        self.max_age = max_age
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.text_factory = unicode
+        self._lock = threading.RLock()
+        columns = [row[1] for row in
+                   self._db.execute('PRAGMA table_info(tag_values)')]
+        if columns and 'number' not in columns:
+            # Replicas made before the number column existed: add it, and
+            # have the next sync fetch every value again to fill it in.
+            self._db.execute('ALTER TABLE tag_values ADD COLUMN number REAL')
+            self._db.execute('UPDATE tag_values SET fetched = 0')
+        self._db.executescript(SCHEMA)
+        self._indexes = {}
+        # Writes since the last commit while a sync batches them, else None.
+        self._batched = None
+        self.evaluator = Evaluator(self, self.remote_query)
+
+    def _query(self, sql, args=()):
+        self._lock.acquire()
+        try:
+            return self._db.execute(sql, args).fetchall()
+        finally:
+            self._lock.release()
+
+    def _execute(self, sql, args=()):
+        self._lock.acquire()
+        try:
+            self._db.execute(sql, args)
+            if self._batched is None:
+                self._db.commit()
+            else:
+                self._batched += 1
+                if self._batched >= COMMIT_EVERY:
+                    self._db.commit()
+                    self._batched = 0
+        finally:
+            self._lock.release()
+
+    def _batch(self, on):
+        """Start or end batching writes into transactions of up to
+        :data:`COMMIT_EVERY` statements; ending it commits the last one.
+        """
+        self._lock.acquire()
+        try:
+            if on:
+                self._batched = 0
+            else:
+                self._batched = None
+                self._db.commit()
+        finally:
+            self._lock.release()
+
+    def covers(self, tag):
+        """Return True if tag is under one of the replicated namespaces.
+        """
+        for namespace in self.namespaces:
+            if tag.startswith(namespace + '/'):
+                return True
+        return False
+
+    def is_synced(self, tag):
+        """Return True if every object with tag has been replicated.
+        """
+        return bool(self._query(
+            'SELECT 1 FROM synced_tags WHERE tag = ?', (tag,)))
+
+    def holds(self, tag):
+        """Return True if every value of tag is held locally.
+        """
+        return self.covers(tag) and self.is_synced(tag)
+
+    def ids_with(self, tag):
+        """Return the set of ids of the objects with tag.
+        """
+        return set(uid for (uid,) in self._query(
+            'SELECT object_id FROM tag_values WHERE tag = ?', (tag,)))
+
+    def values(self, tag):
+        """Return (object id, value) pairs for the primitive values of tag.
+        """
+        return [(uid, codec.loads(value)) for uid, value in self._query(
+            'SELECT object_id, value FROM tag_values '
+            'WHERE tag = ? AND value_type IS NULL', (tag,))]
+
+    def index(self, tag):
+        """Return the :class:`fom.index.TagIndex` for tag, building it when
+        needed.
+        """
+        self._lock.acquire()
+        try:
+            index = self._indexes.get(tag)
+            if index is None:
+                index = self._indexes[tag] = TagIndex(self.values(tag))
+            return index
+        finally:
+            self._lock.release()
+
+    def compare(self, tag, op, value):
+        """Return the set of ids of the objects whose value for tag compares
+        to value with op, one of ``=``, ``<``, ``>``, ``<=`` or ``>=``.
+        """
+        if op in RANGES and is_number(value) and tag not in self._indexes:
+            return set(uid for (uid,) in self._query(
+                'SELECT object_id FROM tag_values '
+                'WHERE tag = ? AND number %s ?' % RANGES[op], (tag, value)))
+        return self.index(tag).compare(op, value)
+
+    def contains(self, tag, value):
+        """Return the set of ids of the objects whose set value for tag
+        contains value.
+        """
+        return self.index(tag).contains(value)
+
+    def find(self, tag, value):
+        """Return the set of ids of the objects with tag set to value.
+        """
+        return self.compare(tag, '=', value)
+
+    def remote_query(self, query):
+        """Run a query on FluidDB and return the matching ids.
+        """
+        status, response = self.fluid.db('GET', '/objects',
+                                          urlargs={'query': query})
+        if status != 200:
+            raise RemoteQueryError(status, response, query)
+        return response[u'ids']
+
+    def query(self, query):
+        """Return the ids of the objects matching a query, evaluating the
+        parts over replicated tags locally.
+        """
+        return self.evaluator.query(query)
+
+    def tags(self):
+        """Return the paths of every tag under the replicated namespaces.
+        """
+        paths = []
+
+        def walk(namespace):
+            paths.extend(namespace.tag_paths)
+            for child in namespace.namespaces:
+                walk(child)
+        for path in self.namespaces:
+            walk(Namespace(path, self.fluid))
+        return paths
+
+    def sync(self, workers=8):
+        """Bring the replica up to date with FluidDB.
+
+        A tag is only marked synced once every one of its values was
+        fetched. A tag with a failed fetch is no longer synced, so lookups
+        of it go to FluidDB until a later sync succeeds.
+
+        The writes are committed every :data:`COMMIT_EVERY` statements and
+        when the sync ends, rather than one by one.
+
+        :returns: The number of values fetched.
+        """
+        from fom.bulk import WorkerPool
+
+        now = time.time()
+        stale = now - self.max_age
+        fetched = [0]
+        failed = set()
+        lock = threading.Lock()
+
+        def fetch(item):
+            uid, tag = item
+            try:
+                ok = self.fetch(uid, tag) is not None
+            except Exception:
+                log.warning('Fetching %s of %s failed', tag, uid,
+                            exc_info=True)
+                ok = False
+            lock.acquire()
+            try:
+                if ok:
+                    fetched[0] += 1
+                else:
+                    failed.add(tag)
+            finally:
+                lock.release()
+
+        listed = []
+        self._batch(True)
+        try:
+            pool = WorkerPool(fetch, workers)
+            try:
+                for tag in self.tags():
+                    try:
+                        ids = set(self.remote_query('has %s' % tag))
+                    except QueryError:
+                        continue
+                    known = dict(self._query(
+                        'SELECT object_id, fetched FROM tag_values '
+                        'WHERE tag = ?', (tag,)))
+                    for uid in set(known) - ids:
+                        self.forget(uid, tag)
+                    for uid in ids:
+                        if known.get(uid, 0) < stale:
+                            pool.put((uid, tag))
+                    listed.append(tag)
+            finally:
+                pool.join()
+            for tag in listed:
+                if tag in failed:
+                    self._execute('DELETE FROM synced_tags WHERE tag = ?',
+                                  (tag,))
+                else:
+                    self._execute('INSERT OR REPLACE INTO synced_tags '
+                                  'VALUES (?, ?)', (tag, now))
+        finally:
+            self._batch(False)
+        return fetched[0]
+
+    def fetch(self, uid, tag):
+        """Read a value from FluidDB into the replica and return it like
+        :meth:`lookup` does.
+        """
+        status, value, value_type = self.fluid.objects[uid][tag].get()
+        if status == 200:
+            self.store(uid, tag, value, value_type)
+            return value, value_type
+        if status == 404:
+            self.forget(uid, tag)
+            return MISSING
+        return None
+
+    def store(self, uid, tag, value, value_type=None):
+        """Record a tag value, if the tag is replicated.
+        """
+        # The object may have gained a tag.
+        self._execute('DELETE FROM objects WHERE object_id = ?', (uid,))
+        if not self.covers(tag):
+            return
+        number = None
+        if value_type is None and is_number(value):
+            number = value
+        self._lock.acquire()
+        try:
+            self._execute('INSERT OR REPLACE INTO tag_values '
+                          'VALUES (?, ?, ?, ?, ?, ?)',
+                          (uid, tag, _encode(value, value_type), value_type,
+                           time.time(), number))
+            self._indexes.pop(tag, None)
+        finally:
+            self._lock.release()
+
+    def forget(self, uid, tag):
+        # The object may have lost a tag.
+        self._execute('DELETE FROM objects WHERE object_id = ?', (uid,))
+        self._lock.acquire()
+        try:
+            self._execute('DELETE FROM tag_values '
+                          'WHERE object_id = ? AND tag = ?', (uid, tag))
+            self._indexes.pop(tag, None)
+        finally:
+            self._lock.release()
+
+    def lookup(self, uid, tag):
+        """Look a value up without any network access.
+
+        :returns: (value, value_type) if it is held, :data:`MISSING` if the
+            replica knows the object has no such tag, or None if it cannot
+            tell.
+        """
+        if not self.covers(tag):
+            return None
+        rows = self._query('SELECT value, value_type FROM tag_values '
+                           'WHERE object_id = ? AND tag = ?', (uid, tag))
+        if rows:
+            value, value_type = rows[0]
+            return _decode(value, value_type), value_type
+        if self.is_synced(tag):
+            return MISSING
+        return None
+
+    def get(self, uid, tag):
+        """Return (value, value_type), or None if the object has no such tag,
+        reading through to FluidDB when the replica cannot tell.
+        """
+        found = self.lookup(uid, tag)
+        if found is None:
+            if not self.covers(tag):
+                status, value, value_type = self.fluid.objects[uid][tag].get()
+                if status == 200:
+                    return value, value_type
+                return None
+            found = self.fetch(uid, tag)
+        if found is MISSING:
+            return None
+        return found
+
+    def has(self, uid, tag):
+        """Return whether the object has the tag, reading through to FluidDB
+        when the replica cannot tell.
+        """
+        found = self.lookup(uid, tag)
+        if found is None:
+            status, response = self.fluid.objects[uid][tag].head()
+            return status == 200
+        return found is not MISSING
+
+    def tag_paths(self, uid):
+        """Return the paths of all of the object's tags, caching the list for
+        ``max_age`` seconds.
+        """
+        rows = self._query('SELECT tag_paths FROM objects WHERE '
+                           'object_id = ? AND fetched >= ?',
+                           (uid, time.time() - self.max_age))
+        if rows:
+            return codec.loads(rows[0][0])
+        status, response = self.fluid.objects[uid].get()
+        paths = response[u'tagPaths']
+        self._execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?)',
+                      (uid, codec.dumps(paths), time.time()))
+        return paths
+
+    def snapshot(self, path):
+        """Write the synced tags to a :mod:`fom.snapshot` file.
+        """
+        from fom.snapshot import write
+
+        tags = [tag for (tag,) in self._query('SELECT tag FROM synced_tags')]
+        write(path, self._query(
+            'SELECT object_id, tag, value, value_type FROM tag_values '
+            'WHERE tag IN (SELECT tag FROM synced_tags)'), tags)
+
+    def close(self):
+        self._db.close()
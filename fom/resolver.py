@@ -0,0 +1,205 @@
+
+"""
+fom.resolver
+============
+
+Caching host name resolution shared by every connection fom opens.
+
+``socket.getaddrinfo`` blocks and is normally repeated for each new
+connection. :class:`Resolver` keeps the answers for a fixed time to live,
+remembers failures for a shorter time so an unresolvable host fails fast, and
+records how long each lookup took so slow DNS can be told apart from a slow
+server.
+
+>>> from fom.resolver import resolver
+>>> resolver.resolve_many([('fluiddb.fluidinfo.com', 80),
+...                        ('sandbox.fluidinfo.com', 443)])
+{('fluiddb.fluidinfo.com', 80): 0.012, ('sandbox.fluidinfo.com', 443): 0.015}
+
+"""
+
+import httplib
+import socket
+import threading
+import time
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+#: Seconds a successful lookup is reused for.
+DEFAULT_TTL = 300
+#: Seconds a failed lookup is remembered for.
+DEFAULT_NEGATIVE_TTL = 30
+
+
+class Resolver(object):
+    """A thread safe getaddrinfo cache with positive and negative TTLs.
+
+    .. attribute:: latencies
+
+        Maps ``(host, port)`` to the duration in seconds of the last real
+        lookup for it. Cache hits do not change it.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.latencies = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def getaddrinfo(self, host, port):
+        """Return the ``getaddrinfo`` result for a TCP connection to
+        host:port, from the cache when it is still fresh.
+
+        :raises socket.gaierror: if the host does not resolve, including when
+            an earlier failure is still cached.
+        """
+        key = (host, port)
+        self._lock.acquire()
+        try:
+            entry = self._cache.get(key)
+        finally:
+            self._lock.release()
+        if entry is not None and entry[0] > time.time():
+            if isinstance(entry[1], Exception):
+                raise entry[1]
+            return entry[1]
+
+        start = time.time()
+        try:
+            info = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        except socket.gaierror, e:
+            self._store(key, start, time.time() + self.negative_ttl, e)
+            raise
+        self._store(key, start, time.time() + self.ttl, info)
+        return info
+
+    def _store(self, key, start, expires, value):
+        self._lock.acquire()
+        try:
+            self.latencies[key] = time.time() - start
+            self._cache[key] = (expires, value)
+        finally:
+            self._lock.release()
+
+    def resolve_many(self, addresses):
+        """Resolve several ``(host, port)`` pairs at the same time.
+
+        Failures are cached but not raised. Returns a dict mapping each
+        address to its lookup latency in seconds, or to None when it did not
+        resolve. Addresses answered from the cache report a latency of 0.
+        """
+        results = {}
+
+        def resolve(address):
+            start = time.time()
+            try:
+                self.getaddrinfo(*address)
+            except socket.gaierror:
+                results[address] = None
+            else:
+                results[address] = time.time() - start
+
+        threads = []
+        for address in set(addresses):
+            thread = threading.Thread(target=resolve, args=(address,))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return results
+
+    def create_connection(self, host, port, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                          sockets=None):
+        """Like ``socket.create_connection`` but resolving through the cache.
+
+        :param sockets: Optional list-like object each socket is appended to
+            before it connects, so another thread can shut it down, even
+            while it is connecting. Its ``append`` may raise
+            ``socket.error`` to give up before connecting.
+        """
+        error = None
+        for family, socktype, proto, canonname, sockaddr in \
+                self.getaddrinfo(host, port):
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if sockets is not None:
+                    sockets.append(sock)
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                sock.connect(sockaddr)
+                return sock
+            except socket.error, e:
+                error = e
+                if sock is not None:
+                    sock.close()
+        raise error or socket.error('getaddrinfo returned an empty list')
+
+    def clear(self):
+        """Forget every cached answer.
+        """
+        self._lock.acquire()
+        try:
+            self._cache.clear()
+        finally:
+            self._lock.release()
+
+
+#: The resolver shared by fom and fluiddbstatus.
+resolver = Resolver()
+
+
+def wrap_ssl(sock, host, key_file=None, cert_file=None, ca_certs=None,
+             validate=True):
+    """Wrap a connected socket for HTTPS, checking the certificate against
+    host where the ssl module supports it.
+    """
+    if hasattr(ssl, 'create_default_context'):
+        context = ssl.create_default_context(cafile=ca_certs)
+        if not validate:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        if cert_file:
+            context.load_cert_chain(cert_file, key_file)
+        return context.wrap_socket(sock, server_hostname=host)
+    return ssl.wrap_socket(sock, key_file, cert_file)
+
+
+class ResolvingConnectionMixin:
+    """Connects through :attr:`resolver` instead of resolving every time.
+
+    Mixed into ``httplib`` style connection classes, which provide ``host``,
+    ``port`` and ``timeout``. It is a classic class on purpose: so are the
+    ``httplib`` connections, and a new-style mixin would put
+    ``object.__init__`` ahead of theirs.
+    """
+
+    resolver = resolver
+    #: Passed on to :meth:`Resolver.create_connection`.
+    sockets = None
+
+    def _open_socket(self):
+        return self.resolver.create_connection(self.host, self.port,
+                                               self.timeout, self.sockets)
+
+
+class HTTPConnection(ResolvingConnectionMixin, httplib.HTTPConnection):
+    """``httplib.HTTPConnection`` using the shared resolver.
+    """
+
+    def connect(self):
+        self.sock = self._open_socket()
+
+
+class HTTPSConnection(ResolvingConnectionMixin, httplib.HTTPSConnection):
+    """``httplib.HTTPSConnection`` using the shared resolver.
+    """
+
+    def connect(self):
+        self.sock = wrap_ssl(self._open_socket(), self.host,
+                             self.key_file, self.cert_file)
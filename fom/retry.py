@@ -0,0 +1,162 @@
+
+"""
+fom.retry
+=========
+
+Retry and hedging policies for :class:`fom.db.RestClient`.
+
+Both are off by default and switched on per client:
+
+>>> from fom.retry import RetryPolicy, HedgePolicy
+>>> fluid.db.client.retry = RetryPolicy(attempts=3)
+>>> fluid.db.client.hedge = HedgePolicy(percentile=0.95)
+
+A :class:`RetryPolicy` retries idempotent requests that failed on the network
+or with a 502, 503 or 504, sleeping a random ("full jitter") exponential
+backoff in between.
+
+A :class:`HedgePolicy` sends a second copy of a GET or HEAD on another pooled
+connection when the first has not answered within the given percentile of
+recent latencies, and uses whichever answers first.
+
+Retries and hedges both spend tokens from a :class:`RetryBudget`, which is
+only refilled by a fraction of each original request. During an outage the
+budget runs dry and extra load stops growing with the failure rate.
+"""
+
+import random
+import threading
+
+#: Methods that can be repeated without changing the result.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+#: Statuses worth retrying.
+RETRY_STATUSES = (502, 503, 504)
+
+
+class RetryBudget(object):
+    """Limits retries and hedges to a fraction of the original requests.
+
+    :param ratio: Tokens added per original request.
+    :param minimum: Tokens available at the start, so a quiet client can
+        still retry.
+    :param cap: The most tokens that can be saved up.
+    """
+
+    def __init__(self, ratio=0.1, minimum=10, cap=100):
+        self.ratio = ratio
+        self.cap = cap
+        self.tokens = float(minimum)
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        """Count an original request.
+        """
+        self._lock.acquire()
+        try:
+            self.tokens = min(self.cap, self.tokens + self.ratio)
+        finally:
+            self._lock.release()
+
+    def withdraw(self):
+        """Take a token for a retry or hedge. Returns False if there is none.
+        """
+        self._lock.acquire()
+        try:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+        finally:
+            self._lock.release()
+
+
+class LatencyTracker(object):
+    """Keeps the latest request latencies to compute percentiles from.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._samples = []
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, latency):
+        self._lock.acquire()
+        try:
+            if len(self._samples) < self.size:
+                self._samples.append(latency)
+            else:
+                self._samples[self._next] = latency
+            self._next = (self._next + 1) % self.size
+        finally:
+            self._lock.release()
+
+    def percentile(self, fraction):
+        """Return the latency at fraction (0 to 1), or None with no samples.
+        """
+        self._lock.acquire()
+        try:
+            samples = sorted(self._samples)
+        finally:
+            self._lock.release()
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class RetryPolicy(object):
+    """How to retry failed idempotent requests.
+
+    :param attempts: The most attempts made, the first one included.
+    :param base_delay: Backoff before the first retry, in seconds. It doubles
+        for every further retry, up to max_delay, and the actual sleep is a
+        random fraction of it.
+    """
+
+    def __init__(self, attempts=3, base_delay=0.05, max_delay=2.0,
+                 budget=None, methods=IDEMPOTENT_METHODS,
+                 statuses=RETRY_STATUSES):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        if budget is None:
+            budget = RetryBudget()
+        self.budget = budget
+        self.methods = methods
+        self.statuses = statuses
+
+    def delay(self, attempt):
+        """Return the sleep before retry number attempt (1 based).
+        """
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** (attempt - 1)))
+
+
+class HedgePolicy(object):
+    """When to send a duplicate of a slow read.
+
+    :param percentile: Hedge once the first attempt is slower than this
+        fraction of recent requests.
+    :param min_samples: Latencies needed before hedging starts.
+    :param min_delay: Never hedge sooner than this many seconds.
+    """
+
+    def __init__(self, percentile=0.95, min_samples=20, min_delay=0.01,
+                 budget=None, methods=('GET', 'HEAD')):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        if budget is None:
+            budget = RetryBudget()
+        self.budget = budget
+        self.methods = methods
+
+    def delay(self, latencies):
+        """Return how long to wait before hedging, or None to not hedge.
+        """
+        if len(latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, latencies.percentile(self.percentile))
@@ -5,21 +5,68 @@ fom.session
 
 Combining a db instance with an API.
 
+A session can be bound so that :mod:`fom.mapping` objects created without an
+explicit session use it. :meth:`Fluid.bind` sets the process wide default;
+:meth:`Fluid.binding` binds a session for the current thread only, which lets
+parallel workers each use their own session:
+
+>>> def worker(url, username, password):
+...     fluid = Fluid(url)
+...     fluid.db.client.login(username, password)
+...     with fluid.binding():
+...         Object(uid).get('test/tag')   # uses this thread's fluid
+
 """
 
+import threading
+
 from fom.api import FluidApi
 from fom.db import FluidDB
 
 
+_local = threading.local()
+
+
+def current_fluid():
+    """Return the session bound to the current thread, or else the default
+    set with :meth:`Fluid.bind`, or None if there is neither.
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        return stack[-1]
+    return Fluid.bound
+
+
+class _Binding(object):
+    """Context manager binding a session to the current thread.
+    """
+
+    def __init__(self, fluid):
+        self.fluid = fluid
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self.fluid)
+        return self.fluid
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.stack.pop()
+
+
 class Fluid(FluidApi):
     """A fluiddb session.
     """
 
-    def __init__(self, base_url=None):
+    #: The default session, set by :meth:`bind`.
+    bound = None
+
+    def __init__(self, base_url=None, pool=None):
         if base_url is not None:
-            db = FluidDB(base_url)
+            db = FluidDB(base_url, pool)
         else:
-            db = FluidDB()
+            db = FluidDB(pool=pool)
         FluidApi.__init__(self, db)
 
     def __call__(self, method, path, payload=None, urlargs=None, **kw):
@@ -28,8 +75,13 @@ class Fluid(FluidApi):
         return self.db.__call__(method, path, payload, urlargs, **kw)
 
     def bind(self):
-        # this is particularly nasty
+        """Make this the default session of every thread that has not bound
+        one with :meth:`binding`.
+        """
         Fluid.bound = self
 
-
-
+    def binding(self):
+        """Return a context manager that binds this session to the current
+        thread for the duration of a ``with`` block. Bindings nest.
+        """
+        return _Binding(self)
@@ -0,0 +1,163 @@
+
+"""
+fom.shard
+=========
+
+Sharded execution of fom work across processes.
+
+Decoding JSON and building objects holds the GIL, so threads alone keep a
+large export or crunching job on one core. A :class:`ShardPool` partitions
+the items (object ids, tag paths, pages ...) into chunks and hands them to a
+pool of processes. Each process keeps its own session and connection pool,
+runs its chunk on a few threads so requests still overlap, and sends back
+only the results:
+
+>>> def title(fluid, uid):
+...     return Object(uid, fluid).get(u'test/books/title')
+>>> shards = ShardPool('http://fluiddb.fluidinfo.com', processes=4)
+>>> titles = shards.map(title, uids)
+>>> shards.close()
+
+The function must be picklable, that is defined at module level (or a
+``functools.partial`` of one). It is called with the process's session and
+one item.
+"""
+
+import multiprocessing
+import sys
+
+from fom.bulk import WorkerPool
+from fom.db import BASE_URL, HttpPool
+from fom.session import Fluid
+
+#: The session of a shard process, made by _initialize.
+_fluid = None
+
+
+def _initialize(base_url, headers, setup, pool_size):
+    global _fluid
+    _fluid = Fluid(base_url, HttpPool(size=pool_size))
+    _fluid.db.client.headers.update(headers)
+    if setup is not None:
+        setup(_fluid)
+    _fluid.bind()
+
+
+def _run_chunk(args):
+    """Call func on each item of a chunk, on up to threads threads, and
+    return the results in order.
+    """
+    func, chunk, threads = args
+    results = [None] * len(chunk)
+    errors = []
+
+    def work(i):
+        try:
+            results[i] = func(_fluid, chunk[i])
+        except Exception:
+            errors.append(sys.exc_info())
+
+    if threads <= 1 or len(chunk) == 1:
+        for i in xrange(len(chunk)):
+            work(i)
+    else:
+        pool = WorkerPool(work, min(threads, len(chunk)))
+        for i in xrange(len(chunk)):
+            pool.put(i)
+        pool.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
+
+def _run_chunk_pairs(args):
+    return zip(args[1], _run_chunk(args))
+
+
+def chunks(items, size):
+    """Split items into lists of up to size items.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ShardPool(object):
+    """A pool of processes, each with its own session.
+
+    :param base_url: The FluidDB the sessions connect to.
+    :param processes: The number of processes, by default one per core.
+    :param headers: Extra headers for every request of the sessions, such as
+        the ``Authorization`` header of a logged in client.
+    :param setup: Called with each new session, for instance to set a retry
+        policy. Must be picklable.
+    :param pool_size: Connections per process.
+    :param threads: Threads per process working on a chunk.
+    """
+
+    def __init__(self, base_url=BASE_URL, processes=None, headers=None,
+                 setup=None, pool_size=8, threads=8):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.threads = threads
+        self.pool = multiprocessing.Pool(
+            processes, _initialize,
+            (base_url, dict(headers or {}), setup, pool_size))
+
+    @classmethod
+    def like(cls, fluid, processes=None, **kw):
+        """Return a pool whose sessions connect to the same FluidDB, with the
+        same credentials, as fluid.
+        """
+        return cls(fluid.db.base_url, processes,
+                   headers=fluid.db.client.headers, **kw)
+
+    def _chunks(self, func, items, chunk_size):
+        return ((func, chunk, self.threads)
+                for chunk in chunks(items, chunk_size))
+
+    def imap(self, func, items, chunk_size=64):
+        """Iterate over func(fluid, item) for each item, in order.
+        """
+        for results in self.pool.imap(_run_chunk,
+                                      self._chunks(func, items, chunk_size)):
+            for result in results:
+                yield result
+
+    def imap_unordered(self, func, items, chunk_size=64):
+        """Iterate over (item, func(fluid, item)) pairs as chunks complete.
+        """
+        for pairs in self.pool.imap_unordered(
+                _run_chunk_pairs, self._chunks(func, items, chunk_size)):
+            for pair in pairs:
+                yield pair
+
+    def map(self, func, items, chunk_size=64):
+        """Return [func(fluid, item) for each item], computed by the pool.
+        """
+        return list(self.imap(func, items, chunk_size))
+
+    def close(self):
+        """Wait for the work to finish and stop the processes.
+        """
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
@@ -0,0 +1,349 @@
+
+"""
+fom.snapshot
+============
+
+A read-only, memory-mapped snapshot of replicated tag values.
+
+A snapshot is written once, from a :class:`fom.replica.Replica` or any
+iterable of values, and then opened by any number of processes. Nothing is
+decoded when it is opened: lookups bisect fixed-width records in the mapped
+file, so every process shares one copy of the data through the page cache.
+
+>>> replica.snapshot('books.snap')
+>>> fluid.db.replica = Snapshot('books.snap')
+>>> Object(uid).get('test/books/title')   # read from the mapped file
+
+:class:`Snapshot` has the interface of a replica, so :mod:`fom.mapping` and
+:meth:`fom.api.ObjectsApi.get` use it the same way. Tags that are not in the
+snapshot are read through to FluidDB.
+
+The file is laid out as::
+
+    magic     'FOMSNAP1'
+    header    counts and section offsets, see HEADER
+    offsets   n_strings + 1 uint64, the start of each string
+    strings   UTF-8 object ids, tag paths and value types, sorted
+    entries   one ENTRY per value, sorted by (object, tag)
+    by_tag    uint32 entry numbers sorted by (tag, object)
+    tags      uint32 string numbers of the tags held
+    values    the encoded values
+
+Strings are referred to by their number in the sorted string table.
+Primitive values are stored as JSON, and opaque ones as they are.
+"""
+
+import mmap
+import os
+import struct
+import threading
+
+from fom import codec
+from fom.index import TagIndex
+from fom.query import Evaluator, RemoteQueryError
+from fom.session import current_fluid
+
+MAGIC = 'FOMSNAP1'
+#: n_strings, n_entries, n_tags, then the offsets of the sections.
+HEADER = struct.Struct('<IIIQQQQQQ')
+#: object, tag, value type (NO_TYPE for primitives), value offset and length.
+ENTRY = struct.Struct('<IIIQI')
+UINT32 = struct.Struct('<I')
+UINT64 = struct.Struct('<Q')
+NO_TYPE = 0xffffffff
+
+#: Marks a tag that the snapshot knows an object does not have.
+MISSING = object()
+
+
+def _utf8(text):
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+def write(path, values, tags):
+    """Write a snapshot.
+
+    :param path: The file to write.
+    :param values: (object id, tag, encoded value, value type) tuples, value
+        type being None for primitive values encoded as JSON.
+    :param tags: The tags whose values are all included; the snapshot answers
+        for those only.
+    """
+    values = [(_utf8(uid), _utf8(tag), str(_utf8(value)),
+               value_type and _utf8(value_type))
+              for uid, tag, value, value_type in values]
+    tags = set(_utf8(tag) for tag in tags)
+    strings = set(tags)
+    for uid, tag, value, value_type in values:
+        strings.add(uid)
+        strings.add(tag)
+        if value_type is not None:
+            strings.add(value_type)
+    strings = sorted(strings)
+    numbers = dict((string, i) for i, string in enumerate(strings))
+    values.sort(key=lambda v: (numbers[v[0]], numbers[v[1]]))
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp, 'wb')
+    try:
+        f.write(MAGIC)
+        f.write('\0' * HEADER.size)
+        offsets_at = f.tell()
+        position = 0
+        for string in strings:
+            f.write(UINT64.pack(position))
+            position += len(string)
+        f.write(UINT64.pack(position))
+        strings_at = f.tell()
+        for string in strings:
+            f.write(string)
+        entries_at = f.tell()
+        position = 0
+        for uid, tag, value, value_type in values:
+            if value_type is None:
+                type_number = NO_TYPE
+            else:
+                type_number = numbers[value_type]
+            f.write(ENTRY.pack(numbers[uid], numbers[tag], type_number,
+                               position, len(value)))
+            position += len(value)
+        by_tag_at = f.tell()
+        order = sorted(range(len(values)),
+                       key=lambda i: (numbers[values[i][1]],
+                                      numbers[values[i][0]]))
+        for i in order:
+            f.write(UINT32.pack(i))
+        tags_at = f.tell()
+        for number in sorted(numbers[tag] for tag in tags):
+            f.write(UINT32.pack(number))
+        values_at = f.tell()
+        for uid, tag, value, value_type in values:
+            f.write(value)
+        f.seek(len(MAGIC))
+        f.write(HEADER.pack(len(strings), len(values), len(tags),
+                            offsets_at, strings_at, entries_at, by_tag_at,
+                            tags_at, values_at))
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+
+class Snapshot(object):
+    """A snapshot opened for reading.
+
+    :param path: The snapshot file.
+    :param fluid: The session to read through to FluidDB with. Defaults to
+        the current session, see :func:`fom.session.current_fluid`.
+    """
+
+    def __init__(self, path, fluid=None):
+        self._fluid = fluid
+        f = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a fom snapshot' % path)
+        (self._n_strings, self._n_entries, self._n_tags, self._offsets_at,
+         self._strings_at, self._entries_at, self._by_tag_at, self._tags_at,
+         self._values_at) = HEADER.unpack_from(self._map, len(MAGIC))
+        self._tags = frozenset(
+            self._string(UINT32.unpack_from(self._map,
+                                            self._tags_at + 4 * i)[0])
+            for i in range(self._n_tags))
+        self._indexes = {}
+        self._overlay = {}
+        self._lock = threading.Lock()
+        self.evaluator = Evaluator(self, self.remote_query)
+
+    def __len__(self):
+        return self._n_entries
+
+    @property
+    def fluid(self):
+        return self._fluid or current_fluid()
+
+    def close(self):
+        self._map.close()
+
+    # The string table
+
+    def _string(self, number):
+        start, end = struct.unpack_from('<QQ', self._map,
+                                        self._offsets_at + 8 * number)
+        return self._map[self._strings_at + start:
+                         self._strings_at + end].decode('utf-8')
+
+    def _number(self, string):
+        """Return the number of string, or None if it is not in the table.
+        """
+        string = _utf8(string)
+        low, high = 0, self._n_strings
+        while low < high:
+            middle = (low + high) // 2
+            start, end = struct.unpack_from('<QQ', self._map,
+                                            self._offsets_at + 8 * middle)
+            found = self._map[self._strings_at + start:
+                              self._strings_at + end]
+            if found < string:
+                low = middle + 1
+            elif found > string:
+                high = middle
+            else:
+                return middle
+        return None
+
+    # Entries
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self._map, self._entries_at + ENTRY.size * i)
+
+    def _find(self, uid, tag):
+        """Return the entry for (uid, tag), or None.
+        """
+        key = (self._number(uid), self._number(tag))
+        if None in key:
+            return None
+        low, high = 0, self._n_entries
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            if entry[:2] < key:
+                low = middle + 1
+            elif entry[:2] > key:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def _decode(self, entry):
+        uid, tag, value_type, offset, length = entry
+        start = self._values_at + offset
+        value = self._map[start:start + length]
+        if value_type == NO_TYPE:
+            return codec.loads(value), None
+        return value, self._string(value_type)
+
+    def _tag_entries(self, tag):
+        """Return the entries of tag, using the by_tag section.
+        """
+        number = self._number(tag)
+        if number is None:
+            return []
+
+        def entry(i):
+            position = UINT32.unpack_from(self._map, self._by_tag_at + 4 * i)
+            return self._entry(position[0])
+
+        low, high = 0, self._n_entries
+        while low < high:
+            middle = (low + high) // 2
+            if entry(middle)[1] < number:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        for i in xrange(low, self._n_entries):
+            found = entry(i)
+            if found[1] != number:
+                break
+            entries.append(found)
+        return entries
+
+    # The replica interface
+
+    def covers(self, tag):
+        return tag in self._tags
+
+    def holds(self, tag):
+        return tag in self._tags
+
+    def ids_with(self, tag):
+        return set(self._string(entry[0]) for entry in self._tag_entries(tag))
+
+    def values(self, tag):
+        return [(self._string(entry[0]), self._decode(entry)[0])
+                for entry in self._tag_entries(tag) if entry[2] == NO_TYPE]
+
+    def index(self, tag):
+        """Return the :class:`fom.index.TagIndex` for tag, building it in
+        this process when needed.
+        """
+        self._lock.acquire()
+        try:
+            index = self._indexes.get(tag)
+            if index is None:
+                index = self._indexes[tag] = TagIndex(self.values(tag))
+            return index
+        finally:
+            self._lock.release()
+
+    def compare(self, tag, op, value):
+        return self.index(tag).compare(op, value)
+
+    def contains(self, tag, value):
+        return self.index(tag).contains(value)
+
+    def find(self, tag, value):
+        return self.compare(tag, '=', value)
+
+    def remote_query(self, query):
+        status, response = self.fluid.db('GET', '/objects',
+                                         urlargs={'query': query})
+        if status != 200:
+            raise RemoteQueryError(status, response, query)
+        return response[u'ids']
+
+    def query(self, query):
+        return self.evaluator.query(query)
+
+    def store(self, uid, tag, value, value_type=None):
+        """Remember a value written since the snapshot was made.
+
+        Such values are seen by :meth:`get` and :meth:`has` in this process,
+        but not by queries.
+        """
+        self._overlay[(uid, tag)] = (value, value_type)
+
+    def lookup(self, uid, tag):
+        """Look a value up without any network access.
+
+        :returns: (value, value_type), :data:`MISSING` if the snapshot knows
+            the object has no such tag, or None if it cannot tell.
+        """
+        if (uid, tag) in self._overlay:
+            return self._overlay[(uid, tag)]
+        if tag not in self._tags:
+            return None
+        entry = self._find(uid, tag)
+        if entry is None:
+            return MISSING
+        return self._decode(entry)
+
+    def get(self, uid, tag):
+        found = self.lookup(uid, tag)
+        if found is None:
+            status, value, value_type = self.fluid.objects[uid][tag].get()
+            if status == 200:
+                return value, value_type
+            return None
+        if found is MISSING:
+            return None
+        return found
+
+    def has(self, uid, tag):
+        found = self.lookup(uid, tag)
+        if found is None:
+            status, response = self.fluid.objects[uid][tag].head()
+            return status == 200
+        return found is not MISSING
+
+    def tag_paths(self, uid):
+        """Return the paths of the object's tags. The snapshot only knows
+        some of them, so this always reads through to FluidDB.
+        """
+        status, response = self.fluid.objects[uid].get()
+        return response[u'tagPaths']
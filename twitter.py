@@ -24,7 +24,6 @@ import base64
 import calendar
 import os
 import rfc822
-import simplejson
 import sys
 import tempfile
 import textwrap
@@ -38,6 +37,8 @@ try:
 except ImportError:
   from md5 import md5
 
+from fom import codec
+
 
 CHARACTER_LIMIT = 140
 
@@ -360,7 +361,7 @@ class Status(object):
     Returns:
       A JSON string representation of this twitter.Status instance
    '''
-    return simplejson.dumps(self.AsDict(), sort_keys=True)
+    return codec.dumps(self.AsDict(), sort_keys=True)
 
   def AsDict(self):
     '''A dict representation of this twitter.Status instance.
@@ -860,7 +861,7 @@ class User(object):
     Returns:
       A JSON string representation of this twitter.User instance
    '''
-    return simplejson.dumps(self.AsDict(), sort_keys=True)
+    return codec.dumps(self.AsDict(), sort_keys=True)
 
   def AsDict(self):
     '''A dict representation of this twitter.User instance.
@@ -1172,7 +1173,7 @@ class DirectMessage(object):
     Returns:
       A JSON string representation of this twitter.DirectMessage instance
    '''
-    return simplejson.dumps(self.AsDict(), sort_keys=True)
+    return codec.dumps(self.AsDict(), sort_keys=True)
 
   def AsDict(self):
     '''A dict representation of this twitter.DirectMessage instance.
@@ -1319,7 +1320,7 @@ class Api(object):
       parameters['since_id'] = since_id
     url = 'http://twitter.com/statuses/public_timeline.json'
     json = self._FetchUrl(url,  parameters=parameters)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return [Status.NewFromJsonDict(x) for x in data]
 
@@ -1369,7 +1370,7 @@ class Api(object):
     if since_id:
       parameters['since_id'] = since_id
     json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return [Status.NewFromJsonDict(x) for x in data]
 
@@ -1412,7 +1413,7 @@ class Api(object):
     else:
       url = 'http://twitter.com/statuses/user_timeline.json'
     json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return [Status.NewFromJsonDict(x) for x in data]
 
@@ -1434,7 +1435,7 @@ class Api(object):
       raise TwitterError("id must be an long integer")
     url = 'http://twitter.com/statuses/show/%s.json' % id
     json = self._FetchUrl(url)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return Status.NewFromJsonDict(data)
 
@@ -1457,7 +1458,7 @@ class Api(object):
       raise TwitterError("id must be an integer")
     url = 'http://twitter.com/statuses/destroy/%s.json' % id
     json = self._FetchUrl(url, post_data={})
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return Status.NewFromJsonDict(data)
 
@@ -1492,7 +1493,7 @@ class Api(object):
     if in_reply_to_status_id:
       data['in_reply_to_status_id'] = in_reply_to_status_id
     json = self._FetchUrl(url, post_data=data)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return Status.NewFromJsonDict(data)
 
@@ -1555,7 +1556,7 @@ class Api(object):
     if page:
       parameters['page'] = page
     json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return [Status.NewFromJsonDict(x) for x in data]
 
@@ -1581,7 +1582,7 @@ class Api(object):
     if page:
       parameters['page'] = page
     json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return [User.NewFromJsonDict(x) for x in data]
 
@@ -1600,7 +1601,7 @@ class Api(object):
     if page:
       parameters['page'] = page
     json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return [User.NewFromJsonDict(x) for x in data]
 
@@ -1614,7 +1615,7 @@ class Api(object):
     '''
     url = 'http://twitter.com/statuses/featured.json'
     json = self._FetchUrl(url)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return [User.NewFromJsonDict(x) for x in data]
 
@@ -1631,7 +1632,7 @@ class Api(object):
     '''
     url = 'http://twitter.com/users/show/%s.json' % user
     json = self._FetchUrl(url)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return User.NewFromJsonDict(data)
 
@@ -1662,7 +1663,7 @@ class Api(object):
     if page:
       parameters['page'] = page 
     json = self._FetchUrl(url, parameters=parameters)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return [DirectMessage.NewFromJsonDict(x) for x in data]
 
@@ -1683,7 +1684,7 @@ class Api(object):
     url = 'http://twitter.com/direct_messages/new.json'
     data = {'text': text, 'user': user}
     json = self._FetchUrl(url, post_data=data)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return DirectMessage.NewFromJsonDict(data)
 
@@ -1702,7 +1703,7 @@ class Api(object):
     '''
     url = 'http://twitter.com/direct_messages/destroy/%s.json' % id
     json = self._FetchUrl(url, post_data={})
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return DirectMessage.NewFromJsonDict(data)
 
@@ -1718,7 +1719,7 @@ class Api(object):
     '''
     url = 'http://twitter.com/friendships/create/%s.json' % user
     json = self._FetchUrl(url, post_data={})
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return User.NewFromJsonDict(data)
 
@@ -1734,7 +1735,7 @@ class Api(object):
     '''
     url = 'http://twitter.com/friendships/destroy/%s.json' % user
     json = self._FetchUrl(url, post_data={})
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return User.NewFromJsonDict(data)
 
@@ -1751,7 +1752,7 @@ class Api(object):
     '''
     url = 'http://twitter.com/favorites/create/%s.json' % status.id
     json = self._FetchUrl(url, post_data={})
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return Status.NewFromJsonDict(data)
 
@@ -1768,7 +1769,7 @@ class Api(object):
     '''
     url = 'http://twitter.com/favorites/destroy/%s.json' % status.id
     json = self._FetchUrl(url, post_data={})
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return Status.NewFromJsonDict(data)
 
@@ -1782,7 +1783,7 @@ class Api(object):
     '''
     url = 'http://twitter.com/users/show.json?email=%s' % email
     json = self._FetchUrl(url)
-    data = simplejson.loads(json)
+    data = codec.loads(json)
     self._CheckForTwitterError(data)
     return User.NewFromJsonDict(data)
 